@@ -1,22 +1,21 @@
-from tinkoff.invest import Client
+import time
 
-from config.config import settings
 from logger.logger import get_logger
 
-from .model import Model
-from .view import View
-
 log = get_logger()
 
 
 class Controller:
+    """
+    Меню приложения. Настройки, подключение к API, модель и построение отчетов (tinkoff.invest, pandas,
+    xlsxwriter) импортируются и создаются при первом использовании, чтобы меню появлялось сразу
+    """
+
     def __init__(self):
-        token = settings.token
-        with Client(token) as client:
-            account = client.users.get_accounts().accounts[0]
-            self.account_id = account.id
-            self.open_date = account.opened_date
-            log.info("Account id successfully received")
+        self._session = None
+        self._model = None
+        self._view = None
+        self._exporter = None
 
         self.available_functions = {
             "ОТЧЕТ": (
@@ -31,9 +30,68 @@ class Controller:
                 "В третьей активы ребалансировки не продаются, и ищется минимальная дополнительная сумма,"
                 "чтобы достичь ребалансировки",
             ),
+            "ЭКСПОРТ": (
+                "Выгрузить данные по портфелю в parquet, csv или json",
+                "Позиции, итоги по видам активов, распределения по секторам и календарь выплат выгружаются"
+                " отдельными таблицами для обработки другими программами",
+            ),
+            "ОНЛАЙН": (
+                "Следить за стоимостью портфеля в реальном времени",
+                "Цены бумаг приходят из потока рыночных данных, стоимость, доли активов и, если задана целевая"
+                " структура, изменения для ребалансировки обновляются с каждой сделкой. Остановка - Ctrl+C",
+            ),
+            "ОБНОВИТЬ": (
+                "Заново загрузить данные по портфелю",
+                "Отчет и ребалансировка используют сохранённый снимок портфеля, пока он не устарел."
+                " Эта функция загружает данные заново",
+            ),
+            "СБРОС": (
+                "Сбросить сохранённую информацию об инструментах",
+                "Номинал, лот, дата погашения и другая информация об инструментах хранится локально и обновляется"
+                " по истечении срока жизни полей. Эта функция удаляет её для одной бумаги или для всех сразу",
+            ),
         }
-        self.model = Model(self.account_id, token, self.open_date)
-        self.view = View()
+
+    @property
+    def session(self):
+        if self._session is None:
+            from api.scheduler import RequestScheduler
+            from api.session import Session
+            from config.config import settings
+
+            scheduler = RequestScheduler(
+                settings.rate_limits, settings.retry_attempts, settings.retry_base_delay, settings.retry_max_delay
+            )
+            self._session = Session(settings.token, scheduler=scheduler)
+        return self._session
+
+    @property
+    def model(self):
+        if self._model is None:
+            from .model import Model
+
+            self._model = Model(None, self.session)
+        return self._model
+
+    @property
+    def view(self):
+        if self._view is None:
+            from .view import View
+
+            self._view = View()
+        return self._view
+
+    @property
+    def exporter(self):
+        if self._exporter is None:
+            from .export import Exporter
+
+            self._exporter = Exporter()
+        return self._exporter
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
 
     def start_work(self):
         print("Привет, это приложение расширенной аналитики брокерского счета в Тинькофф-инвестициях")
@@ -59,6 +117,7 @@ class Controller:
                 print("Статус", status)
             elif query == "ВЫЙТИ":
                 print("Завершение...")
+                self.close()
                 break
             else:
                 print("Такой функции нет")
@@ -68,15 +127,103 @@ class Controller:
             return self.__make_report()
         elif func_name == "РЕБАЛАНСИРОВКА":
             return self.__make_rebalance()
+        elif func_name == "ЭКСПОРТ":
+            return self.__export()
+        elif func_name == "ОНЛАЙН":
+            return self.__live()
+        elif func_name == "ОБНОВИТЬ":
+            return self.__refresh_snapshot()
+        elif func_name == "СБРОС":
+            return self.__invalidate_instruments()
         return "error"
 
     def __make_report(self):
-        data = self.model.get_portfolio_data()
-        if data:
-            return self.view.make_report(data)
+        from config.config import settings
+
+        snapshot = self.model.get_snapshot()
+        if snapshot:
+            diagnostics = self.model.metrics.summary() if settings.report_diagnostics else None
+            history = self.model.get_operations_history() if settings.report_history else None
+            replays = self.model.get_replays() if settings.report_value_history or settings.report_returns else None
+            value_history = self.model.get_value_history(replays) if settings.report_value_history else None
+            returns = self.model.get_returns(replays) if settings.report_returns else None
+            return self.view.make_report(
+                snapshot.data,
+                diagnostics,
+                history,
+                settings.report_streaming,
+                value_history,
+                returns,
+                self.model.get_account_names(),
+            )
+        else:
+            return "error"
+
+    def __export(self):
+        from config.config import settings
+
+        from .export import FORMATS
+
+        formats = input(
+            f"Укажи форматы через пробел ({', '.join(FORMATS)}), по умолчанию {' '.join(settings.export_formats)}\n"
+        ).split()
+        formats = formats or settings.export_formats
+        if any(fmt not in FORMATS for fmt in formats):
+            print("Неизвестный формат")
+            return "error"
+        snapshot = self.model.get_snapshot()
+        if snapshot:
+            value_history = self.model.get_value_history() if settings.report_value_history else None
+            return self.exporter.export(snapshot.data, formats, value_history, self.model.get_account_names())
+        else:
+            return "error"
+
+    def __live(self):
+        from config.config import settings
+
+        from .live import LiveValuation
+
+        snapshot = self.model.get_snapshot()
+        if not snapshot:
+            return "error"
+        structure = {}
+        structure_str = input(
+            "Целевая структура в виде ИНСТРУМЕНТ-ДОЛЯ ИНСТРУМЕНТ-ДОЛЯ..., пустая строка - без ребалансировки\n"
+        ).strip()
+        if structure_str:
+            structure, status = self._check_rebalance_values(structure_str)
+            if status == "error" or not structure:
+                print("Ошибка")
+                return "error"
+
+        live = LiveValuation(*self.model.get_portfolio_for_view(snapshot.data), snapshot.data)
+        shown_at = 0
+        try:
+            for figi, price in self.model.iter_last_prices(live.figis):
+                if live.update(figi, price) and time.monotonic() - shown_at >= settings.live_refresh:
+                    changes = (
+                        self.model.rebalance_1(live.allocation, structure, live.whole_price) if structure else None
+                    )
+                    self.view.show_live(live, changes)
+                    shown_at = time.monotonic()
+        except KeyboardInterrupt:
+            print("Онлайн режим остановлен")
+        return "ready"
+
+    def __refresh_snapshot(self):
+        snapshot = self.model.get_snapshot(refresh=True)
+        if snapshot:
+            print("Данные обновлены", snapshot.captured_at.astimezone().strftime("%Y-%m-%d %H:%M:%S"))
+            return "ready"
         else:
             return "error"
 
+    def __invalidate_instruments(self):
+        figi = input("Укажи figi бумаги, пустая строка - сбросить информацию обо всех инструментах\n").strip()
+        self.model.invalidate_instruments(figi or None)
+        print("Информация сброшена, она будет загружена заново при следующем обращении")
+        return "ready"
+
     def __make_rebalance(self):
         try:
             print("Сначала укажи, какой вид балансировки ты хочешь сделать, напиши 1, 2 или 3")
@@ -116,7 +263,15 @@ class Controller:
                         changes = self.model.rebalance_1(output, rebalance_str, whole_money + money)
                     else:
                         changes = self.model.rebalance_3(output, rebalance_str, whole_money)
-                    return self.view.show_rebalance_changes(changes)
+                    self.view.show_rebalance_changes(changes)
+
+                    decision = input("Рассчитать сделки с учётом лотов? Введи 1, если да\n").strip()
+                    if decision != "1":
+                        return "ready"
+                    lots = self.model.rebalance_lots(
+                        rebalance_str, changes["whole_price"], allow_sell=rebalance_type != "3"
+                    )
+                    return self.view.show_rebalance_changes(lots)
                 else:
                     print("Такого типа нет")
                     errors_count += 1
@@ -127,6 +282,7 @@ class Controller:
             log.error("Ошибка во время ребалансировки", str(e))
             return "error"
 
+    @staticmethod
     def _check_rebalance_values(rebalance_values):
         try:
             suma = 0
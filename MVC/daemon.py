@@ -0,0 +1,206 @@
+import json
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from config.config import settings
+from logger.logger import get_logger
+
+from .export import FORMATS
+
+log = get_logger()
+
+
+def _number(value, name):
+    """Число из тела запроса, строки и true/false числами не считаются"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{name}: ожидается число")
+    return float(value)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon:
+    """
+    Долгоживущий режим: модель, кэши и канал к API остаются прогретыми между запросами, команды принимаются
+    по HTTP на адресе host:port или на unix-сокете unix:/path
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.model = controller.model
+        self._lock = threading.Lock()
+        self.routes = {
+            ("GET", "/snapshot"): self.get_snapshot,
+            ("GET", "/metrics"): self.get_metrics,
+            ("POST", "/refresh"): self.refresh,
+            ("POST", "/report"): self.make_report,
+            ("POST", "/export"): self.export,
+            ("POST", "/rebalance"): self.rebalance,
+            ("POST", "/invalidate"): self.invalidate,
+        }
+
+    def handle(self, method, path, query, body):
+        """
+        Выполнение команды, возвращает HTTP-код и ответ для сериализации в JSON.
+        Команды проверяют тело запроса сами и сообщают об ошибке в нём через ValueError, это код 400,
+        все остальные ошибки - ошибки сервиса с кодом 500
+        """
+        route = self.routes.get((method, path))
+        if route is None:
+            return 404, {"error": "Такой команды нет"}
+        if not isinstance(body, dict):
+            return 400, {"error": "Тело запроса должно быть объектом JSON"}
+        try:
+            with self._lock:
+                return 200, route(query, body)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            log.error("Ошибка при выполнении команды %s %s, %s", method, path, str(e))
+            return 500, {"error": str(e)}
+
+    def get_snapshot(self, query, body):
+        snapshot = self.model.get_snapshot(refresh=query.get("refresh") == "1")
+        if snapshot is None:
+            raise RuntimeError("Не удалось получить данные по портфелю")
+        allocation, whole_price = self.model.get_portfolio_for_view(snapshot.data)
+        aggregates = self.controller.exporter.make_aggregates(snapshot.data)
+        return {
+            "captured_at": snapshot.captured_at.isoformat(),
+            "whole_price": whole_price,
+            "allocation": allocation,
+            "accounts": self.model.get_account_names(),
+            "aggregates": json.loads(aggregates.to_json(orient="records", force_ascii=False)),
+        }
+
+    def get_metrics(self, query, body):
+        return self.model.metrics.summary()
+
+    def refresh(self, query, body):
+        snapshot = self.model.get_snapshot(refresh=True)
+        if snapshot is None:
+            raise RuntimeError("Не удалось получить данные по портфелю")
+        return {"captured_at": snapshot.captured_at.isoformat()}
+
+    def make_report(self, query, body):
+        if self.controller.choice_function("ОТЧЕТ") != "ready":
+            raise RuntimeError("Не удалось создать отчет")
+        return {"status": "ready"}
+
+    def export(self, query, body):
+        formats = body.get("formats") or settings.export_formats
+        if not isinstance(formats, list) or any(fmt not in FORMATS for fmt in formats):
+            raise ValueError("Неизвестный формат")
+        snapshot = self.model.get_snapshot()
+        if snapshot is None:
+            raise RuntimeError("Не удалось получить данные по портфелю")
+        value_history = self.model.get_value_history() if settings.report_value_history else None
+        status = self.controller.exporter.export(snapshot.data, formats, value_history, self.model.get_account_names())
+        if status != "ready":
+            raise RuntimeError("Не удалось выгрузить данные")
+        return {"status": status}
+
+    def rebalance(self, query, body):
+        """
+        body: {"type": 1, 2 или 3, "structure": {вид актива: доля}, "money": доплата для второго типа,
+        "lots": true, чтобы добавить сделки с учётом лотов}. Доли нормируются так, чтобы их сумма была равна 1
+        """
+        rebalance_type = _number(body.get("type"), "type")
+        if rebalance_type not in (1, 2, 3):
+            raise ValueError("Неверный тип ребалансировки")
+        structure = body.get("structure")
+        if not isinstance(structure, dict):
+            raise ValueError("structure должна быть объектом вид актива -> доля")
+        structure = {key: max(_number(value, f"structure.{key}"), 0) for key, value in structure.items()}
+        total = sum(structure.values())
+        if total <= 0:
+            raise ValueError("Сумма долей должна быть больше нуля")
+        structure = {key: value / total for key, value in structure.items() if value > 0}
+        money = _number(body.get("money", 0), "money")
+        lots = body.get("lots", False)
+        if not isinstance(lots, bool):
+            raise ValueError("lots должно быть true или false")
+
+        snapshot = self.model.get_snapshot()
+        if snapshot is None:
+            raise RuntimeError("Не удалось получить данные по портфелю")
+        output, whole_money = self.model.get_portfolio_for_view(snapshot.data)
+        if rebalance_type == 1:
+            changes = self.model.rebalance_1(output, structure, whole_money)
+        elif rebalance_type == 2:
+            changes = self.model.rebalance_1(output, structure, whole_money + money)
+        else:
+            changes = self.model.rebalance_3(output, structure, whole_money)
+        if lots:
+            changes["lots"] = self.model.rebalance_lots(
+                structure, changes["whole_price"], allow_sell=rebalance_type != 3, data=snapshot.data
+            )
+        return changes
+
+    def invalidate(self, query, body):
+        """
+        body: {"figi": figi бумаги}, без figi сбрасывается информация обо всех инструментах
+        """
+        figi = body.get("figi")
+        if figi is not None and not isinstance(figi, str):
+            raise ValueError("figi должен быть строкой")
+        self.model.invalidate_instruments(figi or None)
+        return {"status": "ready"}
+
+    def serve(self, address):
+        handler = self._make_handler()
+        if address.startswith("unix:"):
+            path = address[len("unix:") :]
+            if os.path.exists(path):
+                os.remove(path)
+            server = _UnixHTTPServer(path, handler)
+        else:
+            host, port = address.rsplit(":", 1)
+            server = ThreadingHTTPServer((host, int(port)), handler)
+
+        log.info("Сервис запущен на %s", address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log.info("Остановка сервиса")
+        finally:
+            server.server_close()
+            self.controller.close()
+
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._dispatch()
+
+            def do_POST(self):
+                self._dispatch()
+
+            def _dispatch(self):
+                url = urlparse(self.path)
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    status, payload = 400, {"error": "Тело запроса должно быть в формате JSON"}
+                else:
+                    status, payload = daemon.handle(self.command, url.path, query, body)
+
+                response = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                log.info("%s %s", self.command, self.path)
+
+        return Handler
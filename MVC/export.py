@@ -0,0 +1,126 @@
+import datetime
+import os
+
+import pandas as pd
+
+from logger.logger import get_logger
+
+from .schema import NON_ASSET_KEYS, iter_position_tables
+
+log = get_logger()
+
+FORMATS = ("parquet", "csv", "json")
+# Ключи вида актива с распределением стоимости по группам
+GROUP_KEYS = ("sector", "focus_type")
+
+
+class Exporter:
+    """
+    Выгрузка данных портфеля в машиночитаемые форматы: таблицы позиций, итогов по видам активов,
+    распределений по секторам, календаря выплат и, если передана, дневной стоимости счетов.
+    Счёт в таблицах указывается по id в столбце account, его название - в столбце account_name
+    """
+
+    def export(self, data, formats, value_history=None, account_names=None):
+        try:
+            log.info("Начинаю выгрузку данных: %s", ", ".join(formats))
+            directory = f"results/export_{datetime.datetime.now().strftime('%Y-%m-%d_%H_%M_%S')}"
+            os.makedirs(directory, exist_ok=True)
+
+            tables = {
+                "positions": self.make_positions(data),
+                "aggregates": self.make_aggregates(data),
+                "sectors": self.make_sectors(data),
+                "calendar": self.make_calendar(data),
+            }
+            if value_history:
+                tables["value_history"] = self.make_value_history(value_history)
+            for table in tables.values():
+                self._add_account_names(table, account_names or {})
+            for fmt in formats:
+                for name, table in tables.items():
+                    self._write(table, os.path.join(directory, f"{name}.{fmt}"), fmt)
+
+            log.info("Данные выгружены в %s", directory)
+            return "ready"
+        except Exception as e:
+            log.error("Ошибка во время выгрузки данных, %s", str(e))
+            return "error"
+
+    def make_positions(self, data):
+        """Позиции всех счетов одной таблицей, с типизированными столбцами дат и выплат"""
+        frames = [
+            positions.assign(account=account_id)
+            for account_id, account_data in data.items()
+            for _, _, _, positions in iter_position_tables(account_data)
+        ]
+        if not frames:
+            return pd.DataFrame(columns=["account"])
+        frame = pd.concat(frames, ignore_index=True)
+        frame["div_date"] = pd.to_datetime(frame["div_date"], errors="coerce", utc=True)
+        frame["div_price"] = pd.to_numeric(frame["div_price"], errors="coerce")
+        frame["amortization"] = frame["amortization"].astype("boolean")
+        for column in ("account", "figi", "instrument_type", "bond_kind", "name", "country", "sector", "focus_type"):
+            frame[column] = frame[column].astype("string")
+        return frame[["account", *frame.columns.drop("account")]]
+
+    def make_aggregates(self, data):
+        """Числовые итоги по счетам и видам активов, строка whole - общая стоимость счёта"""
+        rows = []
+        for account_id, account_data in data.items():
+            for instrument_type, asset in account_data.items():
+                if instrument_type in NON_ASSET_KEYS:
+                    continue
+                row = {"account": account_id, "asset": instrument_type}
+                row.update({key: value for key, value in asset.items() if isinstance(value, (int, float))})
+                rows.append(row)
+            rows.append({"account": account_id, "asset": "whole", "total_price": account_data["whole_price"]})
+        return pd.DataFrame(rows).astype({"account": "string", "asset": "string"})
+
+    def make_sectors(self, data):
+        """Распределение стоимости по секторам облигаций и акций и по фокусам фондов"""
+        rows = [
+            {"account": account_id, "asset": instrument_type, "group": key, "name": name, "value": value}
+            for account_id, account_data in data.items()
+            for instrument_type, asset in account_data.items()
+            if instrument_type not in NON_ASSET_KEYS
+            for key in GROUP_KEYS
+            for name, value in asset.get(key, {}).items()
+        ]
+        frame = pd.DataFrame(rows, columns=["account", "asset", "group", "name", "value"])
+        return frame.astype({"account": "string", "asset": "string", "group": "string", "name": "string"})
+
+    def make_calendar(self, data):
+        """Календарь ожидаемых выплат всех счетов"""
+        frames = [
+            account_data["calendar"].rename_axis("month").reset_index().assign(account=account_id)
+            for account_id, account_data in data.items()
+            if "calendar" in account_data
+        ]
+        if not frames:
+            return pd.DataFrame(columns=["account", "month"])
+        frame = pd.concat(frames, ignore_index=True)
+        return frame[["account", *frame.columns.drop("account")]]
+
+    def make_value_history(self, value_history):
+        """Дневная стоимость и вложенный капитал всех счетов"""
+        frame = pd.concat(
+            [history.reset_index().assign(account=account_id) for account_id, history in value_history.items()],
+            ignore_index=True,
+        )
+        frame["account"] = frame["account"].astype("string")
+        return frame[["account", *frame.columns.drop("account")]]
+
+    def _add_account_names(self, table, account_names):
+        names = table["account"].map(account_names).fillna(table["account"])
+        table.insert(1, "account_name", names.astype("string"))
+
+    def _write(self, table, path, fmt):
+        if fmt == "parquet":
+            table.to_parquet(path, index=False)
+        elif fmt == "csv":
+            table.to_csv(path, index=False)
+        elif fmt == "json":
+            table.to_json(path, orient="records", date_format="iso", force_ascii=False)
+        else:
+            raise ValueError(f"Неизвестный формат {fmt}")
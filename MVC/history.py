@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from tinkoff.invest import OperationType
+
+from utils import money
+
+# Знак изменения количества бумаг: покупки и зачисления бумаг увеличивают позицию, продажи и списания уменьшают
+TRADE_SIGNS = {
+    OperationType(15): 1,
+    OperationType(16): 1,
+    OperationType(17): 1,
+    OperationType(20): 1,
+    OperationType(3): -1,
+    OperationType(7): -1,
+    OperationType(18): -1,
+    OperationType(22): -1,
+}
+# Пополнения и выводы денег, из них складывается вложенный капитал
+CAPITAL_TYPES = (OperationType(1), OperationType(9))
+# Полное погашение облигации закрывает позицию, частичное (амортизация) уменьшает номинал
+FULL_REPAYMENT = OperationType(6)
+PARTIAL_REPAYMENT = OperationType(10)
+
+
+def to_days(dates):
+    """Даты с часовым поясом в массив datetime64[D] по UTC"""
+    return pd.to_datetime(list(dates), utc=True).tz_localize(None).to_numpy().astype("datetime64[D]")
+
+
+@dataclass(frozen=True)
+class AccountReplay:
+    """
+    Состояние счёта по дням, восстановленное по операциям: days - дни, figis - бумаги, по которым были сделки,
+    counts и prices - количества и цены одной бумаги в рублях (день x figi), cash и invested - деньги на счёте
+    и вложенный капитал. Для операций: day_idx - номер дня, payments - суммы в рублях, column - номер бумаги
+    в figis или -1, signs - знак сделки или 0, is_capital - пополнение или вывод
+    """
+
+    days: np.ndarray
+    figis: np.ndarray
+    counts: np.ndarray
+    prices: np.ndarray
+    cash: np.ndarray
+    invested: np.ndarray
+    day_idx: np.ndarray
+    payments: np.ndarray
+    column: np.ndarray
+    signs: np.ndarray
+    is_capital: np.ndarray
+
+    @property
+    def values(self):
+        """Стоимость позиций по дням, день x figi"""
+        return self.counts * self.prices
+
+    def value_history(self):
+        """Дневная стоимость счёта и вложенный капитал"""
+        return pd.DataFrame(
+            {"value": self.cash + self.values.sum(axis=1), "invested": self.invested},
+            index=pd.DatetimeIndex(self.days, name="date"),
+        )
+
+
+def replay_account(operations, start, end, closes, multipliers, rates, maturities=None):
+    """
+    Восстановление счёта по дням с start по end.
+    operations - операции счёта без отменённых, closes - figi -> (дни, цены закрытия дневных свечей),
+    multipliers - figi -> множитель от цены свечи к цене одной бумаги в рублях, у облигаций - текущий номинал / 100,
+    rates - курсы валют, maturities - figi -> дата погашения облигации.
+    Деньги и количества бумаг по дням считаются cumsum по дневным изменениям, количества - матрицей день x figi.
+    Полное погашение закрывает позицию облигации. Выплаты амортизации на одну облигацию прибавляются к номиналу
+    дней до выплаты, так как цена свечи облигации - процент от номинала на тот день.
+    В дни без свечей берётся последняя известная цена, до первой свечи - цена сделки, после погашения - ноль
+    """
+    start_day = to_days([start])[0]
+    days = np.arange(start_day, to_days([end])[0] + 1)
+
+    day_idx = np.clip((to_days(op.date for op in operations) - start_day).astype(int), 0, len(days) - 1)
+    payments = money.to_float_array([op.payment for op in operations], rates)
+    operation_types = [op.operation_type for op in operations]
+    is_capital = np.array([op_type in CAPITAL_TYPES for op_type in operation_types], dtype=bool)
+    cash = np.bincount(day_idx, weights=payments, minlength=len(days)).cumsum()
+    invested = np.bincount(day_idx, weights=np.where(is_capital, payments, 0), minlength=len(days)).cumsum()
+
+    signs = np.array([TRADE_SIGNS.get(op.operation_type, 0) for op in operations], dtype=int)
+    trades = np.flatnonzero(signs)
+    figis = np.unique(np.array([operations[i].figi for i in trades], dtype=object))
+    positions = {figi: col for col, figi in enumerate(figis)}
+    column = np.array([positions.get(op.figi, -1) for op in operations], dtype=int)
+
+    counts = np.zeros((len(days), len(figis)))
+    quantities = np.array([operations[i].quantity for i in trades], dtype=float)
+    np.add.at(counts, (day_idx[trades], column[trades]), signs[trades] * quantities)
+    counts = counts.cumsum(axis=0)
+
+    amortized = np.zeros((len(days), len(figis)))  # амортизация после дня на одну облигацию
+    for i in np.flatnonzero(column >= 0):
+        held = counts[day_idx[i], column[i]]
+        if operation_types[i] == PARTIAL_REPAYMENT and held > 0:
+            amortized[: day_idx[i], column[i]] += payments[i] / held
+    repaid = np.flatnonzero((column >= 0) & np.array([t == FULL_REPAYMENT for t in operation_types], dtype=bool))
+    for i in repaid[np.argsort(day_idx[repaid], kind="stable")]:
+        counts[day_idx[i] :, column[i]] -= counts[day_idx[i], column[i]]
+
+    prices = np.full((len(days), len(figis)), np.nan)
+    prices[day_idx[trades], column[trades]] = money.to_float_array([operations[i].price for i in trades], rates)
+    for col, figi in enumerate(figis):
+        candle_days, values = closes.get(figi, (np.array([], dtype="datetime64[D]"), np.array([])))
+        idx = (candle_days - start_day).astype(int)
+        inside = (idx >= 0) & (idx < len(days))
+        prices[idx[inside], col] = values[inside] * (multipliers.get(figi, 1) + amortized[idx[inside], col] / 100)
+    prices = pd.DataFrame(prices).ffill().fillna(0).to_numpy()
+    maturity_days = to_days((maturities or {}).get(figi) for figi in figis)
+    prices[days[:, None] > maturity_days[None, :]] = 0
+
+    return AccountReplay(
+        days=days,
+        figis=figis,
+        counts=counts,
+        prices=prices,
+        cash=cash,
+        invested=invested,
+        day_idx=day_idx,
+        payments=payments,
+        column=column,
+        signs=signs,
+        is_capital=is_capital,
+    )
@@ -0,0 +1,51 @@
+import datetime
+from collections import defaultdict
+
+from .schema import iter_position_tables
+
+
+class LiveValuation:
+    """
+    Стоимость портфеля, которая обновляется по ценам из потока. Новая цена бумаги меняет только её вклад
+    в распределение активов и общую стоимость, остальной портфель не пересчитывается
+    """
+
+    def __init__(self, allocation, whole_price, data):
+        """
+        allocation, whole_price - результат Model.get_portfolio_for_view, data - данные счетов из снимка
+        """
+        self.allocation = dict(allocation)
+        self.whole_price = whole_price
+        self.updated_at = None
+        self.prices = {}
+        # figi -> [(ключ распределения, множитель цены)], множитель - количество, у облигаций ещё номинал / 100
+        self.weights = defaultdict(list)
+        for account_data in data.values():
+            for _, _, group, positions in iter_position_tables(account_data):
+                self._add_positions(group, positions)
+
+    def _add_positions(self, group, positions):
+        is_bond = positions["instrument_type"] == "bond"
+        multipliers = (positions["count"] * positions["nominal"] / 100).where(is_bond, positions["count"])
+        for figi, price, multiplier in zip(positions["figi"], positions["last_price"], multipliers):
+            self.prices[figi] = price
+            self.weights[figi].append((group, multiplier))
+
+    @property
+    def figis(self):
+        return list(self.weights)
+
+    def update(self, figi, price):
+        """
+        Учёт новой цены бумаги, возвращает True, если стоимость портфеля изменилась
+        """
+        old_price = self.prices.get(figi)
+        if old_price is None or old_price == price:
+            return False
+        for group, multiplier in self.weights[figi]:
+            delta = (price - old_price) * multiplier
+            self.allocation[group] = self.allocation.get(group, 0) + delta
+            self.whole_price += delta
+        self.prices[figi] = price
+        self.updated_at = datetime.datetime.now()
+        return True
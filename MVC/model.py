@@ -1,22 +1,157 @@
+import asyncio
 import datetime
+import os
 import time
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
-from tinkoff.invest import Client, InstrumentIdType, InstrumentStatus, OperationType
+import numpy as np
+import pandas as pd
+from tinkoff.invest import (
+    AccountStatus,
+    CandleInterval,
+    InstrumentIdType,
+    InstrumentStatus,
+    LastPriceInstrument,
+    OperationState,
+    OperationType,
+)
+from tinkoff.invest.async_services import AsyncServices
 from tinkoff.invest.services import Services
 from tinkoff.invest.utils import now
 
+from api.session import RECONNECT_CODES
+from config.config import settings
 from logger.logger import get_logger
+from storage.candles import CANDLE_DTYPE, CandleStore
+from storage.instruments import InstrumentCache
+from storage.operations import OperationsLedger
+from storage.schedules import ScheduleCache
+from utils import money
+
+from .history import TRADE_SIGNS, replay_account
+from .rebalance import make_lots_frame, no_sell_total, rebalance_by_lots
+from .returns import account_returns
+from .schema import NON_ASSET_KEYS
+from .valuation import PortfolioValuation, compute_price_columns
 
 log = get_logger()
 
+# Столбцы таблицы позиций, которые заполняются при сборе данных
+POSITION_COLUMNS = [
+    "figi",
+    "instrument_type",
+    "bond_kind",
+    "name",
+    "count",
+    "last_price",
+    "avr_price",
+    "nominal",
+    "current_nominal",
+    "coupon_per",
+    "coupons",
+    "coupons_percent",
+    "coupons_future_profit",
+    "dividend",
+    "div_date",
+    "div_price",
+    "country",
+    "sector",
+    "focus_type",
+    "maturity_date",
+    "placement_date",
+    "amortization",
+]
+NUMERIC_POSITION_COLUMNS = [
+    "count",
+    "last_price",
+    "avr_price",
+    "nominal",
+    "current_nominal",
+    "coupon_per",
+    "coupons",
+    "coupons_percent",
+    "coupons_future_profit",
+    "dividend",
+]
+
+# Виды выплат в календаре в порядке вывода
+CASHFLOW_KINDS = ["coupon", "dividend", "amortization", "redemption"]
+DIVIDENDS_LOOKBACK = datetime.timedelta(days=60)
+
+# Операции за последние сутки загружаются повторно, так как их статус ещё может измениться
+SYNC_OVERLAP = datetime.timedelta(days=1)
+# Длительность свечи и наибольший интервал одного запроса свечей для каждого интервала свечей
+CANDLE_PERIODS = {
+    CandleInterval(1): datetime.timedelta(minutes=1),
+    CandleInterval(2): datetime.timedelta(minutes=5),
+    CandleInterval(3): datetime.timedelta(minutes=15),
+    CandleInterval(4): datetime.timedelta(hours=1),
+    CandleInterval(5): datetime.timedelta(days=1),
+}
+CANDLE_SPANS = {
+    CandleInterval(1): datetime.timedelta(days=1),
+    CandleInterval(2): datetime.timedelta(days=1),
+    CandleInterval(3): datetime.timedelta(days=1),
+    CandleInterval(4): datetime.timedelta(days=7),
+    CandleInterval(5): datetime.timedelta(days=365),
+}
+
+
+@dataclass(frozen=True)
+class PortfolioSnapshot:
+    """
+    Снимок данных портфеля, общий для отчета и ребалансировки. Поля и data не меняются: переоценка
+    по новым ценам создаёт новые данные для следующего снимка, см. PortfolioValuation
+    """
+
+    data: dict
+    captured_at: datetime.datetime
+
+    def age(self):
+        return (datetime.datetime.now(datetime.timezone.utc) - self.captured_at).total_seconds()
+
+    def is_fresh(self, max_age):
+        return self.age() <= max_age
+
 
 class MainModel:
-    def __init__(self, account_id, token, open_date):
-        self.account_id = account_id
-        self.token = token
-        self.open_date = open_date
+    def __init__(self, accounts, session):
+        """
+        accounts - список счетов или None, тогда счета загружаются при первом обращении к self.accounts
+        """
+        self._accounts = accounts
+        self.session = session
+        self.token = session.token
+        self.metrics = session.metrics
         self.currencies = defaultdict(str)
+        self.currency_figis = {}
+
+    @property
+    def accounts(self):
+        if self._accounts is None:
+            self._accounts = self.session.call(self._load_accounts)
+            log.info("Accounts successfully received: %s", len(self._accounts))
+        return self._accounts
+
+    def _load_accounts(self, client: Services):
+        return self._select_accounts(client.users.get_accounts().accounts)
+
+    async def _load_accounts_async(self, client: AsyncServices):
+        """Асинхронный вариант self.accounts: счета загружаются через уже открытый асинхронный клиент"""
+        if self._accounts is None:
+            self._accounts = self._select_accounts((await client.users.get_accounts()).accounts)
+            log.info("Accounts successfully received: %s", len(self._accounts))
+        return self._accounts
+
+    def _select_accounts(self, accounts):
+        """
+        Счета из settings.account_ids, а если они не указаны, то все открытые счета
+        """
+        if settings.account_ids:
+            return [account for account in accounts if account.id in settings.account_ids]
+        return [account for account in accounts if account.status == AccountStatus(2)]
 
     def _convert_money_to_int(self, money):
         res = money.units + money.nano / 10**9
@@ -24,6 +159,28 @@ class MainModel:
             res *= self.currencies.get(money.currency, 1)
         return res
 
+    def _get_last_prices(self, client: Services, figis):
+        """
+        Получение последних цен пачками запросов, возвращает словарь figi -> цена
+        """
+        return self._merge_last_prices(
+            client.market_data.get_last_prices(figi=chunk) for chunk in self._get_price_chunks(figis)
+        )
+
+    def _get_price_chunks(self, figis):
+        """figis без повторов, разбитые на пачки по settings.last_prices_chunk для запросов последних цен"""
+        figis = list(dict.fromkeys(figis))
+        chunk = settings.last_prices_chunk
+        return [figis[i : i + chunk] for i in range(0, len(figis), chunk)]
+
+    def _merge_last_prices(self, responses):
+        return {last_price.figi: last_price.price for response in responses for last_price in response.last_prices}
+
+    def _update_currencies(self, prices):
+        for iso_name, figi in self.currency_figis.items():
+            if figi in prices:
+                self.currencies[iso_name] = self._convert_money_to_int(prices[figi])
+
     def _get_instrument_info(self, client: Services, figi: str, instrument_type: str):
         try:
             if instrument_type == "bond":
@@ -34,291 +191,725 @@ class MainModel:
                 info = client.instruments.etf_by(id_type=InstrumentIdType(1), id=figi)
             else:
                 info = client.instruments.get_instrument_by(id_type=InstrumentIdType(1), id=figi)
-            last_price = client.market_data.get_last_prices(figi=[figi])
-            return info, last_price
+            return info
+        except Exception as e:
+            log.error("Error while getting instrument info %s, %s", figi, str(e))
+            return None
+
+    async def _get_instrument_info_async(self, client: AsyncServices, figi: str, instrument_type: str):
+        try:
+            if instrument_type == "bond":
+                info = await client.instruments.bond_by(id_type=InstrumentIdType(1), id=figi)
+            elif instrument_type == "share":
+                info = await client.instruments.share_by(id_type=InstrumentIdType(1), id=figi)
+            elif instrument_type == "etf":
+                info = await client.instruments.etf_by(id_type=InstrumentIdType(1), id=figi)
+            else:
+                info = await client.instruments.get_instrument_by(id_type=InstrumentIdType(1), id=figi)
+            return info
         except Exception as e:
             log.error("Error while getting instrument info %s, %s", figi, str(e))
-            return None, None
+            return None
 
 
 class Model(MainModel):
-    def __init__(self, account_id, token, open_date):
-        super().__init__(account_id, token, open_date)
+    def __init__(self, accounts, session):
+        super().__init__(accounts, session)
         self.positions_info = {}
+        self.snapshot = None
+        self.valuation = None
+        self.instrument_cache = InstrumentCache(os.path.join(settings.cache_dir, "instruments.sqlite3"))
+        self.operations_ledger = OperationsLedger(os.path.join(settings.cache_dir, "operations.sqlite3"))
+        self.coupon_cache = ScheduleCache(os.path.join(settings.cache_dir, "schedules.sqlite3"), "coupons")
+        self.dividend_cache = ScheduleCache(os.path.join(settings.cache_dir, "schedules.sqlite3"), "dividends")
+        self.candle_store = CandleStore(os.path.join(settings.cache_dir, "candles"))
+        self._currencies_loaded = False
 
-        with Client(token) as client:
-            currencies = client.instruments.currencies(instrument_status=InstrumentStatus(2))
-            # a = client.instruments.currency_by(id="eur")
-            for currency in currencies.instruments:
-                price = client.market_data.get_last_prices(figi=[currency.figi])
-                price = price.last_prices[0].price
-                price = price.units + price.nano / 10**9
-                self.currencies[currency.iso_currency_name] = price
+    def _store_currency_figis(self, response):
+        for currency in response.instruments:
+            self.currency_figis[currency.iso_currency_name] = currency.figi
+        self._currencies_loaded = True
 
-    def get_portfolio_data(self):
-        try:
-            res = {
-                "bond": {
-                    "total_price": 0,
-                    "regular_price": 0,
-                    "floater_price": 0,
-                    "total_amount": 0,
-                    "regular_amount": 0,
-                    "floater_amount": 0,
-                    "floater_coupon": 0,
-                    "regular_coupon": 0,
-                    "regular_positions": [],
-                    "floater_positions": [],
-                    "sector": defaultdict(int),
-                },
-                "share": {
-                    "total_price": 0,
-                    "total_amount": 0,
-                    "buy_profit": 0,
-                    "positions": [],
-                    "dividend": 0,
-                    "sector": defaultdict(int),
-                },
-                "etf": {
-                    "total_price": 0,
-                    "total_amount": 0,
-                    "buy_profit": 0,
-                    "positions": [],
-                    "focus_type": defaultdict(int),
-                },
-            }
-            whole_price = 0
+    def _get_currency_figis(self, client: Services, currencies):
+        """
+        figi валют, которые есть в портфеле. Список валют загружается один раз и только если в портфеле есть не рубли
+        """
+        if self._needs_currency_list(currencies):
+            self._store_currency_figis(client.instruments.currencies(instrument_status=InstrumentStatus(2)))
+        return self._select_currency_figis(currencies)
+
+    def _needs_currency_list(self, currencies):
+        return not self._currencies_loaded and any(currency not in self.currency_figis for currency in currencies)
 
-            with Client(self.token) as client:
-                log.info("Получение данных по портфелю")
+    def _select_currency_figis(self, currencies):
+        return [self.currency_figis[currency] for currency in currencies if currency in self.currency_figis]
+
+    def _get_held_currencies(self, accounts_data, securities):
+        """
+        Валюты, которые встречаются в портфеле: остатки, средние цены, выплаты и валюты бумаг
+        """
+        currencies = set()
+        for positions, portfolio, operations in accounts_data:
+            currencies.update(value.currency for value in positions.money)
+            currencies.update(value.currency for value in positions.blocked)
+            currencies.update(position.average_position_price.currency for position in portfolio.positions)
+            currencies.update(op.payment.currency for op in self._get_payment_operations(operations))
+        currencies.update(self.positions_info[figi]["info"].currency for figi in securities)
+        currencies.difference_update(("rub", ""))
+        return sorted(currencies)
+
+    def get_snapshot(self, refresh=False):
+        """
+        Снимок портфеля, данные обновляются только если снимок старше settings.snapshot_max_age или refresh.
+        Если изменились только цены, снимок переоценивается без полной загрузки, см. get_repriced_data.
+        После загрузки статистика вызовов API сохраняется в settings.metrics_file, если он указан
+        """
+        if refresh or self.snapshot is None or not self.snapshot.is_fresh(settings.snapshot_max_age):
+            data = None if refresh else self.get_repriced_data()
+            if data is None:
+                if settings.async_engine:
+                    data = asyncio.run(self.get_portfolio_data_async())
+                else:
+                    data = self.get_portfolio_data()
+            if not data:
+                return None
+            self.snapshot = PortfolioSnapshot(data=data, captured_at=datetime.datetime.now(datetime.timezone.utc))
+            if settings.metrics_file:
+                self.metrics.dump(settings.metrics_file)
+        return self.snapshot
 
-                positions = client.operations.get_positions(account_id=self.account_id)
-                portfolio = client.operations.get_portfolio(account_id=self.account_id)
-                operations = client.operations.get_operations(
-                    account_id=self.account_id,
-                    from_=self.open_date,
-                    to=now(),
+    def get_repriced_data(self):
+        """
+        Переоценка данных последней полной загрузки по новым ценам бумаг и курсам валют. Возвращает None,
+        если полной загрузки ещё не было, она старше settings.full_refresh_interval или изменился состав счетов
+        """
+        valuation = self.valuation
+        if valuation is None or time.time() - valuation.built_at > settings.full_refresh_interval:
+            return None
+        try:
+            return self.session.call(lambda client: self._reprice(client, valuation))
+        except Exception as e:
+            log.error("Ошибка при переоценке портфеля %s", str(e))
+            return None
+
+    def _reprice(self, client: Services, valuation):
+        with ThreadPoolExecutor(max_workers=settings.max_concurrency) as executor:
+            holdings = dict(
+                zip(
+                    (account.id for account in self.accounts),
+                    executor.map(
+                        lambda account: self._get_holdings(client.operations.get_positions(account_id=account.id)),
+                        self.accounts,
+                    ),
                 )
+            )
+        if holdings != valuation.holdings:
+            log.info("Состав счетов изменился, нужна полная загрузка")
+            return None
+
+        rates = dict(self.currencies)
+        prices = self._get_last_prices(client, valuation.figis + self._select_currency_figis(rates))
+        self._update_currencies(prices)
+        changed = [currency for currency, rate in rates.items() if self.currencies.get(currency) != rate]
+        if changed:
+            accounts = valuation.get_accounts_with(changed)
+            valuation.replace_accounts(
+                {account_id: self._rebuild_account(valuation.sources[account_id], prices) for account_id in accounts}
+            )
+            log.info("Изменились курсы валют %s, пересчитано счетов: %s", ", ".join(changed), len(accounts))
+
+        last_prices = dict(zip(prices, money.to_float_array(list(prices.values()))))
+        log.info("Портфель переоценён, изменились цены бумаг: %s", valuation.reprice(last_prices))
+        return valuation.data
 
-                blocked_money = sum(self._convert_money_to_int(item) for item in positions.blocked)
-                whole_price += blocked_money
+    def _rebuild_account(self, source, prices):
+        """Пересчёт данных счёта по сохранённым исходным данным и новым ценам и курсам, без запросов к API"""
+        positions, portfolio, payments, coupons, dividends = source
+        return self.build_portfolio_data(positions, portfolio, payments, prices, coupons, dividends)
 
-                uid_bond_float = self.get_positions_info(positions, client)
-                dividens, dividend_per_share, coupons_per_bond, coupons_float, coupons_reg = self.process_operations(
-                    operations, client, uid_bond_float
+    def _get_holdings(self, positions):
+        """
+        Состав счёта: количества бумаг и остатки денег. Пока он не меняется, данные счёта зависят только от цен
+        """
+        return (
+            sorted((position.figi, position.balance, position.blocked) for position in positions.securities),
+            sorted((value.currency, value.units, value.nano) for value in positions.money),
+            sorted((value.currency, value.units, value.nano) for value in positions.blocked),
+        )
+
+    def get_portfolio_data(self):
+        """
+        Аналитика по всем счетам: id счёта -> данные счёта
+        """
+        try:
+            log.info("Получение данных по портфелю")
+            res = self._build_accounts_data(*self.session.call(self._collect_portfolio_data))
+            log.info("Данные успешно получены")
+            time.sleep(0.08)
+            return res
+        except Exception as e:
+            log.error("Error while getting portfolio data %s", str(e))
+            return {}
+
+    def _collect_portfolio_data(self, client: Services):
+        """
+        Загрузка данных по всем счетам. Счета загружаются параллельно, информация об инструментах, цены,
+        купоны и дивиденды запрашиваются один раз для каждого figi
+        """
+        with ThreadPoolExecutor(max_workers=settings.max_concurrency) as executor:
+            accounts_data = dict(
+                zip(
+                    (account.id for account in self.accounts),
+                    executor.map(lambda account: self._collect_account_data(client, account), self.accounts),
                 )
+            )
+
+            securities = self._get_securities(accounts_data.values())
+            instruments = self._get_instruments(accounts_data.values(), securities)
+            missing = self._get_missing_instruments(instruments)
+            self._store_instruments(
+                missing, executor.map(lambda item: self._get_instrument_info(client, *item), missing)
+            )
+            currencies = self._get_held_currencies(accounts_data.values(), securities)
+            prices = self.resolve_prices(securities, client, currencies)
+
+            coupon_dates, stale_shares = self._get_stale_schedules(securities)
+            dividends_from, dividends_to = self._get_dividends_range()
+            coupon_events = executor.map(
+                lambda item: client.instruments.get_bond_coupons(**self._get_coupons_request(*item)).events,
+                coupon_dates.items(),
+            )
+            dividend_events = executor.map(
+                lambda figi: client.instruments.get_dividends(
+                    figi=figi, from_=dividends_from, to=dividends_to
+                ).dividends,
+                stale_shares,
+            )
+            coupons, dividends = self._merge_schedules(
+                securities, coupon_dates, list(coupon_events), stale_shares, list(dividend_events)
+            )
+
+        return accounts_data, prices, coupons, dividends
+
+    def _collect_account_data(self, client: Services, account):
+        positions = client.operations.get_positions(account_id=account.id)
+        portfolio = client.operations.get_portfolio(account_id=account.id)
+        operations = self.sync_operations(client, account)
+        return positions, portfolio, operations
+
+    def _get_missing_instruments(self, instruments):
+        """Инструменты, информацию о которых нужно запросить: список пар (figi, тип инструмента)"""
+        return [
+            (figi, instrument_type)
+            for figi, instrument_type in instruments.items()
+            if self._get_cached_instrument(figi) is None
+        ]
+
+    def _store_instruments(self, missing, infos):
+        for (figi, instrument_type), info in zip(missing, infos):
+            self._store_instrument(figi, instrument_type, info.instrument)
+
+    def _get_stale_schedules(self, securities):
+        """
+        Графики выплат, которые нужно запросить: облигация -> дата, с которой загружаются купоны,
+        и акции с устаревшими дивидендами
+        """
+        coupon_dates = {}
+        for figi, instrument_type in securities.items():
+            if instrument_type == "bond":
+                from_ = self._get_coupons_refresh_date(figi)
+                if from_ is not None:
+                    coupon_dates[figi] = from_
+        stale_shares = [
+            figi
+            for figi, instrument_type in securities.items()
+            if instrument_type == "share" and not self._is_dividends_fresh(figi)
+        ]
+        return coupon_dates, stale_shares
 
-                portfolio_average_prices = dict()
-
-                for op in portfolio.positions:
-                    portfolio_average_prices[op.figi] = self._convert_money_to_int(op.average_position_price)
-
-                for money in positions.money:
-                    cur_price = self._convert_money_to_int(money)
-                    if money.currency != "rub":
-                        cur_price *= self.currencies.get(money.currency, 1)
-                    whole_price += cur_price
-
-                for position in positions.securities:
-                    if position.instrument_type == "bond":  # облигация
-                        cnt = position.balance
-                        info, price = (
-                            self.positions_info[position.figi]["info"],
-                            self.positions_info[position.figi]["price"],
-                        )
-
-                        initial_nominal = self._convert_money_to_int(info.initial_nominal)
-                        price = price.last_prices[0].price
-                        price = ((price.units + price.nano / 10**9) / 100) * initial_nominal
-                        res["bond"]["total_amount"] += cnt
-                        res["bond"]["total_price"] += price * cnt
-
-                        if info.floating_coupon_flag:
-                            res["bond"]["floater_amount"] += cnt
-                            res["bond"]["floater_price"] += price * cnt
-                            res["bond"]["floater_positions"].append(
-                                {
-                                    "name": info.name,
-                                    "coupon_per": info.coupon_quantity_per_year,
-                                    "one_price": price,
-                                    "count": cnt,
-                                    "whole_price": cnt * price,
-                                    "avr_price": portfolio_average_prices[position.figi],
-                                    "coupons": coupons_per_bond.get(info.name, 0),
-                                    "country": info.country_of_risk_name,
-                                    "nominal": self._convert_money_to_int(info.initial_nominal),
-                                    "maturity_date": info.maturity_date,
-                                    "placement_date": info.placement_date,
-                                    "days_before_maturity": (
-                                        info.maturity_date - datetime.datetime.now(datetime.timezone.utc)
-                                    ).days,
-                                    "amortization": info.amortization_flag,
-                                }
-                            )
-                        else:
-                            coups = client.instruments.get_bond_coupons(
-                                figi=position.figi, from_=info.placement_date, to=info.maturity_date
-                            )
-                            nearest_coupon_idx = 0
-                            left, right = 0, len(coups.events) - 1
-                            while left <= right:
-                                mid = (left + right) // 2
-                                if coups.events[mid].coupon_date < datetime.datetime.now(datetime.timezone.utc):
-                                    left = mid + 1
-                                else:
-                                    nearest_coupon_idx = mid
-                                    right = mid - 1
-                            pay_one_bond = self._convert_money_to_int(coups.events[nearest_coupon_idx].pay_one_bond)
-                            if pay_one_bond == 0:  # если следующий купон не определен
-                                pay_one_bond = self._convert_money_to_int(
-                                    coups.events[max(0, nearest_coupon_idx - 1)].pay_one_bond
-                                )
-                            coupons_percent = (
-                                pay_one_bond
-                                * info.coupon_quantity_per_year
-                                / self._convert_money_to_int(info.initial_nominal)
-                            )
-                            coupons_percent = round(coupons_percent * 100, 1)
-                            coups.events = coups.events[nearest_coupon_idx:]
-
-                            coupons_profit = 0
-                            for coup in coups.events:
-                                pay = coup.pay_one_bond
-                                coupons_profit += self._convert_money_to_int(pay) * cnt
-                            buy_profit = (price - portfolio_average_prices[position.figi]) * cnt
-
-                            res["bond"]["regular_amount"] += cnt
-                            res["bond"]["regular_price"] += price * cnt
-                            res["bond"]["regular_positions"].append(
-                                {
-                                    "name": info.name,
-                                    "coupon_per": info.coupon_quantity_per_year,
-                                    "one_price": price,
-                                    "count": cnt,
-                                    "whole_price": cnt * price,
-                                    "avr_price": portfolio_average_prices[position.figi],
-                                    "coupons": coupons_per_bond.get(info.name, 0),
-                                    "country": info.country_of_risk_name,
-                                    "coupons_percent": coupons_percent,
-                                    "nominal": initial_nominal,
-                                    "maturity_date": info.maturity_date,
-                                    "days_before_maturity": (
-                                        info.maturity_date - datetime.datetime.now(datetime.timezone.utc)
-                                    ).days,
-                                    "placement_date": info.placement_date,
-                                    "amortization": info.amortization_flag,
-                                    "coupons_future_profit": coupons_profit,
-                                    "buy_profit": buy_profit,
-                                }
-                            )
-
-                        res["bond"]["sector"][info.sector] += price * cnt
-                        whole_price += price * cnt
-                    elif position.instrument_type == "share":  # акция
-                        cnt = position.balance
-                        info, price = (
-                            self.positions_info[position.figi]["info"],
-                            self.positions_info[position.figi]["price"],
-                        )
-
-                        divs = client.instruments.get_dividends(
-                            figi=position.figi,
-                            from_=datetime.datetime.now(),
-                            to=datetime.datetime.now() + datetime.timedelta(days=180),
-                        )
-                        if divs.dividends:
-                            div_date = divs.dividends[0].record_date.strftime("%Y-%m-%d")
-                            div_value = divs.dividends[0].dividend_net
-                            div_price = self._convert_money_to_int(div_value) * cnt
-                        else:
-                            div_date = ""
-                            div_price = ""
-
-                        price = price.last_prices[0].price
-                        price = self._convert_money_to_int(price)
-
-                        res["share"]["total_price"] += price * cnt
-                        res["share"]["total_amount"] += cnt
-                        res["share"]["buy_profit"] += (price - portfolio_average_prices[position.figi]) * cnt
-                        res["share"]["positions"].append(
-                            {
-                                "name": info.name,
-                                "country": info.country_of_risk_name,
-                                "one_price": price,
-                                "count": cnt,
-                                "whole_price": cnt * price,
-                                "avr_price": portfolio_average_prices[position.figi],
-                                "dividend": dividend_per_share.get(info.name, 0),
-                                "div_date": div_date,
-                                "div_price": div_price,
-                            }
-                        )
-                        res["share"]["sector"][info.sector] += price * cnt
-                        whole_price += price * cnt
-                    elif position.instrument_type == "etf":  # фонд
-                        cnt = position.balance
-                        info, price = (
-                            self.positions_info[position.figi]["info"],
-                            self.positions_info[position.figi]["price"],
-                        )
-
-                        price = price.last_prices[0].price
-                        price = self._convert_money_to_int(price)
-
-                        res["etf"]["total_price"] += price * cnt
-                        res["etf"]["total_amount"] += cnt
-                        res["etf"]["buy_profit"] += (price - portfolio_average_prices[position.figi]) * cnt
-                        res["etf"]["positions"].append(
-                            {
-                                "name": info.name,
-                                "one_price": price,
-                                "count": cnt,
-                                "whole_price": cnt * price,
-                                "focus_type": info.focus_type,
-                                "avr_price": portfolio_average_prices[position.figi],
-                            }
-                        )
-                        res["etf"]["focus_type"][info.focus_type] += price * cnt
-                        whole_price += price * cnt
-                    else:
-                        instrument_type = position.instrument_type
-                        cnt = position.balance
-                        info, price = (
-                            self.positions_info[position.figi]["info"],
-                            self.positions_info[position.figi]["price"],
-                        )
-
-                        price = price.last_prices[0].price
-                        price = self._convert_money_to_int(price)
-
-                        res.setdefault(instrument_type, {"total_price": 0, "total_amount": 0, "positions": []})
-
-                        res[instrument_type]["total_price"] += price * cnt
-                        res[instrument_type]["total_amount"] += cnt
-                        res[instrument_type]["positions"].append(
-                            {"name": info.name, "one_price": price, "count": cnt, "whole_price": cnt * price}
-                        )
-                        whole_price += price * cnt
-                res["whole_price"] = whole_price
-                res["share"]["dividend"] = dividens
-                res["bond"]["floater_coupon"] = coupons_float
-                res["bond"]["regular_coupon"] = coupons_reg
-
-                res["bond"]["regular_positions"].sort(key=lambda x: x["whole_price"], reverse=True)
-                res["bond"]["floater_positions"].sort(key=lambda x: x["whole_price"], reverse=True)
-                res["share"]["positions"].sort(key=lambda x: x["whole_price"], reverse=True)
-                res["etf"]["positions"].sort(key=lambda x: x["whole_price"], reverse=True)
-
-                log.info("Данные успешно получены")
-                time.sleep(0.08)
-                return res
+    def _get_coupons_request(self, figi, from_):
+        return {"figi": figi, "from_": from_, "to": self.positions_info[figi]["info"].maturity_date}
+
+    def _merge_schedules(self, securities, coupon_dates, coupon_events, stale_shares, dividend_events):
+        """
+        Сохранение загруженных графиков в кэши, coupon_events и dividend_events - ответы в порядке coupon_dates
+        и stale_shares. Возвращает купоны облигаций и дивиденды акций, остальные графики берутся из кэша
+        """
+        for (figi, from_), events in zip(coupon_dates.items(), coupon_events):
+            self._store_coupons(figi, from_, events)
+        for figi, events in zip(stale_shares, dividend_events):
+            self.dividend_cache.set(figi, events, time.time())
+        coupons = {
+            figi: self.coupon_cache.get(figi)[0]
+            for figi, instrument_type in securities.items()
+            if instrument_type == "bond"
+        }
+        dividends = {
+            figi: self.dividend_cache.get(figi)[0]
+            for figi, instrument_type in securities.items()
+            if instrument_type == "share"
+        }
+        return coupons, dividends
+
+    def _get_coupons_refresh_date(self, figi):
+        """
+        Дата, с которой нужно загрузить купоны, или None, если сохранённого графика достаточно.
+        Загруженный график обновляется только начиная с первого будущего купона с неопределённой выплатой
+        """
+        cached = self.coupon_cache.get(figi)
+        if cached is None:
+            return self.positions_info[figi]["info"].placement_date
+        events, updated_at = cached
+        if time.time() - updated_at < settings.coupons_refresh_ttl:
+            return None
+        current = datetime.datetime.now(datetime.timezone.utc)
+        for event in events:
+            if event.coupon_date >= current and self._convert_money_to_int(event.pay_one_bond) == 0:
+                return event.coupon_date
+        return None
+
+    def _store_coupons(self, figi, from_, events):
+        cached = self.coupon_cache.get(figi)
+        if cached is not None:
+            events = [event for event in cached[0] if event.coupon_date < from_] + list(events)
+        self.coupon_cache.set(figi, events, time.time())
+        return events
+
+    def _is_dividends_fresh(self, figi):
+        cached = self.dividend_cache.get(figi)
+        return cached is not None and time.time() - cached[1] < settings.dividends_refresh_ttl
+
+    def _get_dividends_range(self):
+        """
+        Дивиденды запрашиваются на горизонт календаря выплат, с запасом назад для уже зафиксированных, но не выплаченных
+        """
+        current = datetime.datetime.now(datetime.timezone.utc)
+        return current - DIVIDENDS_LOOKBACK, current + datetime.timedelta(days=31 * settings.calendar_months)
+
+    async def get_portfolio_data_async(self):
+        """
+        Асинхронный вариант get_portfolio_data: запросы по счетам и инструментам выполняются параллельно,
+        одновременно выполняется не больше settings.max_concurrency запросов.
+        Что запрашивать и как сохранять ответы в кэши, решают те же методы, что и в синхронном варианте.
+        Асинхронный клиент открывается через Session.call_async, с тем же переподключением при обрыве
+        """
+        try:
+            log.info("Получение данных по портфелю")
+            res = self._build_accounts_data(*await self.session.call_async(self._collect_portfolio_data_async))
+            log.info("Данные успешно получены")
+            return res
         except Exception as e:
-            log.error("Error while getting portfolio data", str(e))
+            log.error("Error while getting portfolio data %s", str(e))
             return {}
 
-    def get_portfolio_for_view(self):
-        """Получение распределения активов для вывода в консоль"""
-        data = self.get_portfolio_data()
+    async def _collect_portfolio_data_async(self, client: AsyncServices):
+        semaphore = asyncio.Semaphore(settings.max_concurrency)
+
+        async def call(method, *args, **kwargs):
+            async with semaphore:
+                return await method(*args, **kwargs)
+
+        accounts = await self._load_accounts_async(client)
+        ranges = [self._get_operations_sync_range(account) for account in accounts]
+        responses = await asyncio.gather(
+            *(
+                asyncio.gather(
+                    call(client.operations.get_positions, account_id=account.id),
+                    call(client.operations.get_portfolio, account_id=account.id),
+                    call(client.operations.get_operations, account_id=account.id, from_=from_, to=to),
+                )
+                for account, (from_, to) in zip(accounts, ranges)
+            )
+        )
+        accounts_data = {
+            account.id: (
+                positions,
+                portfolio,
+                self._store_operations(account, operations.operations, to),
+            )
+            for account, (_, to), (positions, portfolio, operations) in zip(accounts, ranges, responses)
+        }
+
+        securities = self._get_securities(accounts_data.values())
+        instruments = self._get_instruments(accounts_data.values(), securities)
+        missing = self._get_missing_instruments(instruments)
+        self._store_instruments(
+            missing,
+            await asyncio.gather(
+                *(
+                    call(self._get_instrument_info_async, client, figi, instrument_type)
+                    for figi, instrument_type in missing
+                )
+            ),
+        )
+
+        currencies = self._get_held_currencies(accounts_data.values(), securities)
+        if self._needs_currency_list(currencies):
+            self._store_currency_figis(await call(client.instruments.currencies, instrument_status=InstrumentStatus(2)))
+        price_responses = await asyncio.gather(
+            *(
+                call(client.market_data.get_last_prices, figi=chunk)
+                for chunk in self._get_price_chunks(list(securities) + self._select_currency_figis(currencies))
+            )
+        )
+        prices = self._merge_last_prices(price_responses)
+        self._update_currencies(prices)
+
+        coupon_dates, stale_shares = self._get_stale_schedules(securities)
+        dividends_from, dividends_to = self._get_dividends_range()
+        coupon_responses, dividend_responses = await asyncio.gather(
+            asyncio.gather(
+                *(
+                    call(client.instruments.get_bond_coupons, **self._get_coupons_request(figi, from_))
+                    for figi, from_ in coupon_dates.items()
+                )
+            ),
+            asyncio.gather(
+                *(
+                    call(client.instruments.get_dividends, figi=figi, from_=dividends_from, to=dividends_to)
+                    for figi in stale_shares
+                )
+            ),
+        )
+        coupons, dividends = self._merge_schedules(
+            securities,
+            coupon_dates,
+            [response.events for response in coupon_responses],
+            stale_shares,
+            [response.dividends for response in dividend_responses],
+        )
+        return accounts_data, prices, coupons, dividends
+
+    def _build_accounts_data(self, accounts_data, prices, coupons, dividends):
+        res = {
+            account_id: self.build_portfolio_data(positions, portfolio, operations, prices, coupons, dividends)
+            for account_id, (positions, portfolio, operations) in accounts_data.items()
+        }
+        holdings = {}
+        sources = {}
+        currencies = {}
+        for account_id, (positions, portfolio, operations) in accounts_data.items():
+            holdings[account_id] = self._get_holdings(positions)
+            sources[account_id] = (positions, portfolio, self._get_payment_operations(operations), coupons, dividends)
+            securities = [position.figi for position in positions.securities]
+            currencies[account_id] = set(self._get_held_currencies([(positions, portfolio, operations)], securities))
+        self.valuation = PortfolioValuation(res, holdings, sources, currencies)
+        return res
+
+    def get_account_names(self):
+        """
+        Названия счетов для отчетов: id счёта -> название. Данные счетов хранятся по id, так как названия
+        могут совпадать, к совпадающим названиям добавляется id
+        """
+        counts = Counter(account.name for account in self.accounts)
+        names = {}
+        for account in self.accounts:
+            if not account.name:
+                names[account.id] = account.id
+            elif counts[account.name] > 1:
+                names[account.id] = f"{account.name} ({account.id})"
+            else:
+                names[account.id] = account.name
+        return names
+
+    def _get_securities(self, accounts_data):
+        """
+        Бумаги всех счетов без повторов: figi -> тип инструмента
+        """
+        return {
+            position.figi: position.instrument_type
+            for positions, _, _ in accounts_data
+            for position in positions.securities
+        }
+
+    def _get_instruments(self, accounts_data, securities):
+        """
+        Бумаги всех счетов и инструменты, по которым были выплаты: figi -> тип инструмента
+        """
+        instruments = dict(securities)
+        for _, _, operations in accounts_data:
+            for op in self._get_payment_operations(operations):
+                instruments.setdefault(op.figi, op.instrument_type)
+        return instruments
+
+    def build_portfolio_data(self, positions, portfolio, operations, prices, coupons, dividends):
+        """
+        Расчёт аналитики по уже загруженным данным, без запросов к API.
+        coupons - figi -> купоны облигаций, dividends - figi -> ближайшие дивиденды акций
+        """
+        whole_price = float(money.to_float_array(positions.blocked, self.currencies).sum())
+        whole_price += float(money.to_float_array(positions.money, self.currencies).sum())
+
+        uid_bond_float = self._get_floater_uids(positions)
+        dividens, dividend_per_share, coupons_per_bond, coupons_float, coupons_reg = self.process_operations(
+            operations, uid_bond_float
+        )
+
+        portfolio_average_prices = dict(
+            zip(
+                (op.figi for op in portfolio.positions),
+                money.to_float_array([op.average_position_price for op in portfolio.positions], self.currencies),
+            )
+        )
+        last_prices = dict(zip(prices, money.to_float_array(list(prices.values()))))
+
+        frame = self.make_positions_frame(
+            positions, last_prices, portfolio_average_prices, coupons_per_bond, dividend_per_share, coupons, dividends
+        )
+        res = self.aggregate_positions(frame)
+
+        res["whole_price"] = whole_price + float(frame["whole_price"].sum())
+        res["share"]["dividend"] = dividens
+        res["bond"]["floater_coupon"] = coupons_float
+        res["bond"]["regular_coupon"] = coupons_reg
+        res["calendar"] = self.build_cashflow_calendar(frame, coupons, dividends)
+        return res
+
+    def make_positions_frame(
+        self, positions, prices, average_prices, coupons_per_bond, dividend_per_share, coupons, dividends
+    ):
+        """
+        Таблица позиций: одна строка на бумагу, цены и доходности считаются по столбцам целиком
+        """
+        rows = []
+        for position in positions.securities:
+            info = self.positions_info[position.figi]["info"]
+            row = {
+                "figi": position.figi,
+                "instrument_type": position.instrument_type,
+                "name": info.name,
+                "count": position.balance,
+                "last_price": prices[position.figi],
+                "avr_price": average_prices.get(position.figi, 0),
+            }
+            if position.instrument_type == "bond":  # облигация
+                row.update(
+                    {
+                        "bond_kind": "floater" if info.floating_coupon_flag else "regular",
+                        "nominal": self._convert_money_to_int(info.initial_nominal),
+                        "current_nominal": self._convert_money_to_int(info.nominal),
+                        "coupon_per": info.coupon_quantity_per_year,
+                        "coupons": coupons_per_bond.get(info.name, 0),
+                        "country": info.country_of_risk_name,
+                        "sector": info.sector,
+                        "maturity_date": info.maturity_date,
+                        "placement_date": info.placement_date,
+                        "amortization": info.amortization_flag,
+                    }
+                )
+            elif position.instrument_type == "share":  # акция
+                row.update(
+                    {
+                        "country": info.country_of_risk_name,
+                        "sector": info.sector,
+                        "dividend": dividend_per_share.get(info.name, 0),
+                    }
+                )
+                row.update(self._get_nearest_dividend(dividends[position.figi], position.balance))
+            elif position.instrument_type == "etf":  # фонд
+                row["focus_type"] = info.focus_type
+            rows.append(row)
+
+        frame = pd.DataFrame(rows, columns=POSITION_COLUMNS)
+        frame[NUMERIC_POSITION_COLUMNS] = frame[NUMERIC_POSITION_COLUMNS].astype(float).fillna(0)
+        frame["maturity_date"] = pd.to_datetime(frame["maturity_date"], utc=True)
+        frame["placement_date"] = pd.to_datetime(frame["placement_date"], utc=True)
+        self._project_coupons(frame, coupons)
+
+        compute_price_columns(frame)
+        frame["days_before_maturity"] = (
+            (frame["maturity_date"] - pd.Timestamp.now(tz="UTC")).dt.days.fillna(0).astype(int)
+        )
+
+        return frame.sort_values("whole_price", ascending=False, ignore_index=True)
+
+    def _project_coupons(self, frame, coupons):
+        """
+        Купонная доходность и сумма будущих купонов сразу для всех обычных облигаций: графики склеиваются
+        в один массив, ближайший купон ищется через searchsorted, остаток купонов считается через cumsum
+        """
+        regular = frame.index[frame["bond_kind"] == "regular"]
+        if len(regular) == 0:
+            return
+        schedules = [coupons.get(figi, []) for figi in frame.loc[regular, "figi"]]
+        lengths = np.array([len(events) for events in schedules])
+        if lengths.sum() == 0:
+            return
+        dates = np.array([event.coupon_date.timestamp() for events in schedules for event in events])
+        pays = money.to_float_array([event.pay_one_bond for events in schedules for event in events], self.currencies)
+
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        # ключ (номер облигации, дата) упорядочен, так как купоны каждой облигации идут по возрастанию даты
+        offset = dates.min()
+        span = dates.max() - offset + 1
+        keys = np.repeat(np.arange(len(lengths)), lengths) * span + (dates - offset)
+        current = np.clip(time.time() - offset, 0, span)
+        nearest = np.searchsorted(keys, np.arange(len(lengths)) * span + current, side="left")
+
+        last = len(pays) - 1
+        next_pay = np.where(nearest < ends, pays[np.clip(nearest, 0, last)], 0)
+        prev_pay = pays[np.clip(np.maximum(nearest - 1, starts), 0, last)]
+        pay_one_bond = np.where(next_pay == 0, prev_pay, next_pay)  # если следующий купон не определен
+        pay_one_bond = np.where(lengths > 0, pay_one_bond, 0)
+
+        cumulative = np.concatenate(([0], np.cumsum(pays)))
+        remaining = cumulative[ends] - cumulative[nearest]
+
+        nominal = frame.loc[regular, "nominal"].to_numpy()
+        coupons_percent = np.divide(
+            pay_one_bond * frame.loc[regular, "coupon_per"].to_numpy(),
+            nominal,
+            out=np.zeros(len(regular)),
+            where=nominal > 0,
+        )
+        frame.loc[regular, "coupons_percent"] = np.round(coupons_percent * 100, 1)
+        frame.loc[regular, "coupons_future_profit"] = remaining * frame.loc[regular, "count"].to_numpy()
+
+    def _get_nearest_dividend(self, divs, cnt):
+        current = datetime.datetime.now(datetime.timezone.utc)
+        divs = [div for div in divs if div.record_date >= current]
+        if divs:
+            return {
+                "div_date": divs[0].record_date.strftime("%Y-%m-%d"),
+                "div_price": self._convert_money_to_int(divs[0].dividend_net) * cnt,
+            }
+        return {"div_date": "", "div_price": ""}
+
+    def build_cashflow_calendar(self, frame, coupons, dividends):
+        """
+        Помесячный календарь ожидаемых выплат на settings.calendar_months вперёд по сохранённым графикам.
+        Неопределённые будущие купоны оцениваются последним известным купоном облигации
+        """
+        current = pd.Timestamp.now(tz="UTC")
+        months = pd.period_range(current.tz_localize(None).to_period("M"), periods=settings.calendar_months, freq="M")
+        parts = []
+
+        bonds = frame[frame["instrument_type"] == "bond"]
+        schedules = [coupons.get(figi, []) for figi in bonds["figi"]]
+        lengths = [len(events) for events in schedules]
+        if sum(lengths):
+            bond_idx = np.repeat(np.arange(len(bonds)), lengths)
+            pays = pd.Series(
+                money.to_float_array([event.pay_one_bond for events in schedules for event in events], self.currencies)
+            )
+            pays = pays.where(pays > 0).groupby(bond_idx).ffill().fillna(0).to_numpy()
+            parts.append(
+                pd.DataFrame(
+                    {
+                        "date": pd.to_datetime(
+                            [event.coupon_date for events in schedules for event in events], utc=True
+                        ),
+                        "kind": "coupon",
+                        "amount": pays * bonds["count"].to_numpy()[bond_idx],
+                    }
+                )
+            )
+        parts.append(
+            pd.DataFrame(
+                {
+                    "date": bonds["maturity_date"],
+                    "kind": np.where(bonds["amortization"] == True, "amortization", "redemption"),  # noqa: E712
+                    "amount": bonds["current_nominal"] * bonds["count"],
+                }
+            )
+        )
+
+        shares = frame[frame["instrument_type"] == "share"]
+        dividend_rows = [
+            (div.payment_date if div.payment_date.year > 1970 else div.record_date, div.dividend_net, count)
+            for figi, count in zip(shares["figi"], shares["count"])
+            for div in dividends.get(figi, [])
+        ]
+        if dividend_rows:
+            dates, values, counts = zip(*dividend_rows)
+            parts.append(
+                pd.DataFrame(
+                    {
+                        "date": pd.to_datetime(list(dates), utc=True),
+                        "kind": "dividend",
+                        "amount": money.to_float_array(list(values), self.currencies) * np.array(counts),
+                    }
+                )
+            )
+
+        events = pd.concat(parts, ignore_index=True)
+        events = events[events["date"] >= current]
+        events["month"] = events["date"].dt.tz_localize(None).dt.to_period("M")
+        calendar = events.pivot_table(index="month", columns="kind", values="amount", aggfunc="sum")
+        calendar = calendar.reindex(index=months, columns=CASHFLOW_KINDS).fillna(0)
+        calendar["total"] = calendar.sum(axis=1)
+        calendar.index = calendar.index.strftime("%Y-%m")
+        return calendar
+
+    def aggregate_positions(self, frame):
+        """
+        Итоги по видам активов, секторам, фокусам фондов и типам облигаций через groupby по таблице позиций
+        """
+        totals = frame.groupby("instrument_type")[["whole_price", "count", "buy_profit"]].sum()
+
+        def total(instrument_type, column):
+            return float(totals[column].get(instrument_type, 0))
+
+        bonds = frame[frame["instrument_type"] == "bond"]
+        bond_kinds = bonds.groupby("bond_kind")[["whole_price", "count"]].sum()
+        shares = frame[frame["instrument_type"] == "share"]
+        etfs = frame[frame["instrument_type"] == "etf"]
+
+        res = {
+            "bond": {
+                "total_price": total("bond", "whole_price"),
+                "regular_price": float(bond_kinds["whole_price"].get("regular", 0)),
+                "floater_price": float(bond_kinds["whole_price"].get("floater", 0)),
+                "total_amount": total("bond", "count"),
+                "regular_amount": float(bond_kinds["count"].get("regular", 0)),
+                "floater_amount": float(bond_kinds["count"].get("floater", 0)),
+                "floater_coupon": 0,
+                "regular_coupon": 0,
+                "regular_positions": bonds[bonds["bond_kind"] == "regular"].reset_index(drop=True),
+                "floater_positions": bonds[bonds["bond_kind"] == "floater"].reset_index(drop=True),
+                "sector": bonds.groupby("sector")["whole_price"].sum().to_dict(),
+            },
+            "share": {
+                "total_price": total("share", "whole_price"),
+                "total_amount": total("share", "count"),
+                "buy_profit": total("share", "buy_profit"),
+                "positions": shares.reset_index(drop=True),
+                "dividend": 0,
+                "sector": shares.groupby("sector")["whole_price"].sum().to_dict(),
+            },
+            "etf": {
+                "total_price": total("etf", "whole_price"),
+                "total_amount": total("etf", "count"),
+                "buy_profit": total("etf", "buy_profit"),
+                "positions": etfs.reset_index(drop=True),
+                "focus_type": etfs.groupby("focus_type")["whole_price"].sum().to_dict(),
+            },
+        }
+        for instrument_type in frame["instrument_type"].unique():
+            if instrument_type not in res:
+                res[instrument_type] = {
+                    "total_price": total(instrument_type, "whole_price"),
+                    "total_amount": total(instrument_type, "count"),
+                    "positions": frame[frame["instrument_type"] == instrument_type].reset_index(drop=True),
+                }
+        return res
+
+    def get_portfolio_for_view(self, data=None):
+        """Получение распределения активов по всем счетам для вывода в консоль"""
+        if data is None:
+            data = self.get_snapshot().data
+        res = defaultdict(float)
+        whole_price = 0
+        for account_data in data.values():
+            allocation, account_price = self._get_allocation(account_data)
+            for pos, value in allocation.items():
+                res[pos] += value
+            whole_price += account_price
+        return dict(res), whole_price
+
+    def _get_allocation(self, data):
+        """Распределение активов одного счёта"""
         whole_price = data["whole_price"]
         active_sum = 0
         res = {}
@@ -331,10 +922,11 @@ class Model(MainModel):
                     res["regular_bond"] = data[pos]["regular_price"]
                     active_sum += data[pos]["regular_price"]
             else:
-                if pos != "whole_price" and data[pos]["total_price"] > 0:
+                if pos not in NON_ASSET_KEYS and data[pos]["total_price"] > 0:
                     res[pos] = data[pos]["total_price"]
                     active_sum += data[pos]["total_price"]
-        res["currency"] = whole_price - active_sum
+        # валютные позиции и денежные остатки попадают в одну долю
+        res["currency"] = res.get("currency", 0) + whole_price - active_sum
         return res, whole_price
 
     def rebalance_1(self, old_structure, new_structure, whole_money):
@@ -352,22 +944,11 @@ class Model(MainModel):
         return res
 
     def rebalance_3(self, old_structure, new_structure, whole_money):
-        def check_sum(old_structure, new_structure, money):
-            for pos in new_structure:
-                if money * new_structure[pos] < old_structure.get(pos, 0):
-                    return False
-            return True
-
-        l = whole_money
-        r = whole_money * 100
-        while r - l > 100:
-            mid = (l + r) / 2
-            if check_sum(old_structure, new_structure, mid):
-                r = mid
-            else:
-                l = mid
-
-        new_sum = l
+        """
+        Ребалансировка без продаж: стоимость портфеля увеличивается ровно настолько, чтобы каждая группа
+        поместилась в свою долю, см. no_sell_total
+        """
+        new_sum = no_sell_total(old_structure, new_structure, whole_money)
         res = {}
         for pos in new_structure:
             cur_price = old_structure.get(pos, 0)
@@ -379,56 +960,331 @@ class Model(MainModel):
         res["whole_price"] = round(new_sum, 2)
         return res
 
-    def process_operation(self, op, client):  # TODO скорее всего бесполезно
+    def rebalance_lots(self, new_structure, whole_money, allow_sell=True, data=None):
         """
-        Получение информации и цены.
+        Количества бумаг для сделок с учётом лотов и текущих цен: название бумаги -> изменение,
+        "currency" - деньги, которые останутся после сделок. Без allow_sell бумаги только докупаются
         """
-        if op.figi in self.positions_info:
-            info = self.positions_info[op.figi]["info"]
-        else:
-            info, price = self._get_instrument_info(client, op.figi, op.instrument_type)
-            info = info.instrument
-            self.positions_info[op.figi] = {"info": info, "price": price}
-
-        value = self._convert_money_to_int(op.payment)
-        return info, value
-
-    def process_operations(self, operations, client, uid_bond_float):
-        """
-        Получение информации по купонам и дивидендам для бумаг в портфеле
-        """
-        dividens = 0
-        dividend_per_share = defaultdict(int)
-        coupons_per_bond = defaultdict(int)
-        coupons_float = 0
-        coupons_reg = 0
-
-        for op in operations.operations:
-            if op.operation_type == OperationType(21):  # дивиденды
-                info, value = self.process_operation(op, client)
-                dividens += value
-                dividend_per_share[info.name] += value
-            elif op.operation_type == OperationType(23):  # купоны
-                info, value = self.process_operation(op, client)
-                coupons_per_bond[info.name] += value
-                if op.position_uid in uid_bond_float:
-                    coupons_float += value
-                else:
-                    coupons_reg += value
+        if data is None:
+            data = self.get_snapshot().data
+        old_structure, _ = self.get_portfolio_for_view(data)
+        lots = {figi: info["info"].lot for figi, info in self.positions_info.items()}
+        frame, cash = rebalance_by_lots(
+            make_lots_frame(data, lots), old_structure, new_structure, whole_money, allow_sell
+        )
+        res = {}
+        for row in frame[frame["lots_delta"] != 0].itertuples(index=False):
+            res[row.name] = (
+                f"{int(row.count)}->{int(row.new_count)} : {int(row.lots_delta):+} лот. по {int(row.lot)}"
+                f" ({round(row.money_delta, 2)})"
+            )
+        res["currency"] = round(cash, 2)
+        return res
+
+    def process_operations(self, operations, uid_bond_float):
+        """
+        Получение информации по купонам и дивидендам для бумаг в портфеле.
+        Суммы выплат переводятся в рубли одним пакетом, при settings.exact_money суммирование идёт в Decimal
+        """
+        payments = self._get_payment_operations(operations)
+        frame = pd.DataFrame(
+            {
+                "name": [self.positions_info[op.figi]["info"].name for op in payments],
+                "is_dividend": np.array([op.operation_type == OperationType(21) for op in payments], dtype=bool),
+                "is_floater": np.array([op.position_uid in uid_bond_float for op in payments], dtype=bool),
+                "value": money.convert([op.payment for op in payments], self.currencies, exact=settings.exact_money),
+            }
+        )
+        dividends = frame[frame["is_dividend"]]  # дивиденды
+        coupons = frame[~frame["is_dividend"]]  # купоны
+
+        dividens = float(dividends["value"].sum())
+        dividend_per_share = {name: float(value) for name, value in dividends.groupby("name")["value"].sum().items()}
+        coupons_per_bond = {name: float(value) for name, value in coupons.groupby("name")["value"].sum().items()}
+        coupons_float = float(coupons.loc[coupons["is_floater"], "value"].sum())
+        coupons_reg = float(coupons.loc[~coupons["is_floater"], "value"].sum())
 
         return dividens, dividend_per_share, coupons_per_bond, coupons_float, coupons_reg
 
-    def get_positions_info(self, positions, client):
+    def resolve_prices(self, securities, client, currencies):
         """
-        Сохранение информации и цены для всех инструментов, а также получегие возвар множества с id флоатеров
+        Получение последних цен всех бумаг портфеля и валют из currencies пачками запросов,
+        возвращает словарь figi -> цена
         """
-        uid_bond_float = set()
+        figis = list(securities)
+        figis.extend(self._get_currency_figis(client, currencies))
+        prices = self._get_last_prices(client, figis)
+        self._update_currencies(prices)
+        return prices
 
-        for position in positions.securities:
-            info, price = self._get_instrument_info(client, position.figi, position.instrument_type)
-            info = info.instrument
+    def _get_operations_sync_range(self, account):
+        synced_to = self.operations_ledger.last_synced(account.id)
+        open_date = account.opened_date
+        from_ = open_date if synced_to is None else max(open_date, synced_to - SYNC_OVERLAP)
+        return from_, now()
 
-            self.positions_info[position.figi] = {"info": info, "price": price}
-            if position.instrument_type == "bond" and info.floating_coupon_flag:
-                uid_bond_float.add(position.position_uid)
-        return uid_bond_float
+    def sync_operations(self, client, account):
+        """
+        Дозагрузка операций с момента последней синхронизации в локальный журнал, возвращает все операции счёта
+        """
+        from_, to = self._get_operations_sync_range(account)
+        operations = client.operations.get_operations(account_id=account.id, from_=from_, to=to)
+        return self._store_operations(account, operations.operations, to)
+
+    def _store_operations(self, account, operations, synced_to):
+        """Сохранение загруженных операций в журнал, возвращает все операции счёта"""
+        self.operations_ledger.save(account.id, operations, synced_to)
+        return self.operations_ledger.get_operations(account.id)
+
+    def iter_last_prices(self, figis):
+        """
+        Последние цены figis из потока рыночных данных: пары (figi, цена) по мере поступления сделок.
+        При обрыве соединения канал открывается заново и подписка повторяется
+        """
+        while True:
+            try:
+                yield from self._stream_last_prices(self.session.client, figis)
+                return
+            except Exception as e:
+                if getattr(e, "code", None) not in RECONNECT_CODES:
+                    raise
+                log.warning("Поток цен прерван, переподключение: %s", str(e))
+                self.session.reconnect()
+
+    def _stream_last_prices(self, client: Services, figis):
+        stream = client.create_market_data_stream()
+        stream.last_price.subscribe(instruments=[LastPriceInstrument(figi=figi) for figi in figis])
+        try:
+            for response in stream:
+                if response.last_price is not None:
+                    yield response.last_price.figi, money.to_float(response.last_price.price)
+        finally:
+            stream.stop()
+
+    def get_operations_history(self):
+        """
+        История операций по всем счетам: id счёта -> генератор строк для отчета
+        """
+        return {account.id: self.iter_operations_history(account) for account in self.accounts}
+
+    def iter_operations_history(self, account):
+        """
+        Строки истории операций счёта из локального журнала по одной, без загрузки всей истории в память
+        """
+        for op in self.operations_ledger.iter_operations(account.id):
+            info = self.positions_info.get(op.figi)
+            yield [
+                op.date.astimezone().strftime("%Y-%m-%d %H:%M:%S"),
+                op.type or op.operation_type.name,
+                info["info"].name if info else op.figi,
+                op.figi,
+                op.quantity,
+                money.to_float(op.price),
+                money.to_float(op.payment),
+                op.payment.currency,
+            ]
+
+    def get_replays(self):
+        """
+        Счета, восстановленные по дням, см. _replay_accounts, при ошибке - пустой результат.
+        Один результат передаётся в get_value_history и get_returns, чтобы журнал операций,
+        информация об инструментах и свечи загружались для отчета один раз
+        """
+        try:
+            log.info("Восстановление счетов по операциям и свечам")
+            res = self.session.call(self._replay_accounts)
+            log.info("Счета восстановлены")
+            return res
+        except Exception as e:
+            log.error("Ошибка при восстановлении счетов %s", str(e))
+            return {}, {}
+
+    def get_value_history(self, replays=None):
+        """
+        Дневная стоимость портфеля и вложенный капитал по всем счетам с даты открытия:
+        id счёта -> таблица со столбцами value и invested. replays - результат get_replays
+        """
+        try:
+            return self._build_value_history(replays or self.get_replays())
+        except Exception as e:
+            log.error("Ошибка при восстановлении истории стоимости %s", str(e))
+            return {}
+
+    def _build_value_history(self, replays):
+        replays, _ = replays
+        return {account_id: replay.value_history() for account_id, replay in replays.items()}
+
+    def get_returns(self, replays=None):
+        """
+        Доходность XIRR и TWR счёта, видов активов и бумаг по всем счетам: id счёта -> таблица.
+        replays - результат get_replays
+        """
+        try:
+            return self._build_returns(replays or self.get_replays())
+        except Exception as e:
+            log.error("Ошибка при расчёте доходности %s", str(e))
+            return {}
+
+    def _build_returns(self, replays):
+        replays, instrument_types = replays
+        names = {figi: self.positions_info[figi]["info"].name for figi in instrument_types}
+        return {account_id: account_returns(replay, instrument_types, names) for account_id, replay in replays.items()}
+
+    def _replay_accounts(self, client: Services):
+        """
+        Восстановление всех счетов по дням: количества бумаг - по журналу операций, цены - по дневным свечам,
+        свечи каждой бумаги запрашиваются один раз для всех счетов, начиная с первой сделки по ней.
+        Отменённые операции не учитываются. Возвращает id счёта -> AccountReplay и figi -> тип инструмента
+        """
+        operations = {
+            account.id: [
+                op for op in self.operations_ledger.iter_operations(account.id) if op.state != OperationState(2)
+            ]
+            for account in self.accounts
+        }
+        first_trades = {}
+        for account_operations in operations.values():
+            for op in account_operations:
+                if op.operation_type in TRADE_SIGNS and op.figi:
+                    if op.figi not in first_trades or op.date < first_trades[op.figi].date:
+                        first_trades[op.figi] = op
+
+        end = now()
+        with ThreadPoolExecutor(max_workers=settings.max_concurrency) as executor:
+            infos = dict(
+                zip(
+                    first_trades,
+                    executor.map(
+                        lambda op: self.get_instrument(op.figi, op.instrument_type, client), first_trades.values()
+                    ),
+                )
+            )
+        self.sync_candles(client, {figi: (op.date, end) for figi, op in first_trades.items()}, CandleInterval(5))
+        closes = {figi: self._get_daily_closes(figi, op.date, end) for figi, op in first_trades.items()}
+        multipliers = {
+            figi: (
+                self._convert_money_to_int(info.nominal) / 100
+                if first_trades[figi].instrument_type == "bond"
+                else float(money.fx_multipliers([info.currency or "rub"], self.currencies)[0])
+            )
+            for figi, info in infos.items()
+        }
+        maturities = {
+            figi: info.maturity_date for figi, info in infos.items() if first_trades[figi].instrument_type == "bond"
+        }
+        replays = {
+            account.id: replay_account(
+                operations[account.id], account.opened_date, end, closes, multipliers, self.currencies, maturities
+            )
+            for account in self.accounts
+        }
+        return replays, {figi: op.instrument_type for figi, op in first_trades.items()}
+
+    def _get_daily_closes(self, figi, from_, to):
+        """Дни и цены закрытия дневных свечей за период из локального хранилища"""
+        candles = self.candle_store.get(figi, CandleInterval(5), from_, to)
+        return candles["time"].astype("datetime64[D]"), candles["close"]
+
+    def sync_candles(self, client: Services, periods, interval):
+        """
+        Дозагрузка свечей в локальное хранилище, periods - figi -> (from_, to).
+        Запрашиваются только промежутки, которых ещё нет в хранилище, длиннее одной свечи, и хвост до to,
+        чтобы незавершённая свеча обновлялась и при повторной синхронизации в тот же день. Промежутки режутся
+        на куски по CANDLE_SPANS и загружаются параллельно. Незавершённая свеча сохраняется,
+        но загруженным промежуток считается только до её начала, поэтому она будет запрошена ещё раз
+        """
+        chunks = []
+        for figi, (from_, to) in periods.items():
+            for start, end in self.candle_store.missing(
+                figi, interval, from_, to, CANDLE_PERIODS[interval].total_seconds()
+            ):
+                while start < end:
+                    chunks.append((figi, start, min(start + CANDLE_SPANS[interval], end)))
+                    start = chunks[-1][2]
+        if not chunks:
+            return
+
+        with ThreadPoolExecutor(max_workers=settings.max_concurrency) as executor:
+            responses = executor.map(
+                lambda chunk: client.market_data.get_candles(
+                    figi=chunk[0], from_=chunk[1], to=chunk[2], interval=interval
+                ).candles,
+                chunks,
+            )
+            loaded = defaultdict(lambda: ([], []))
+            for (figi, start, end), candles in zip(chunks, responses):
+                incomplete = [candle.time for candle in candles if not candle.is_complete]
+                loaded[figi][0].extend(candles)
+                loaded[figi][1].append((start, min([end, *incomplete])))
+
+        for figi, (candles, ranges) in loaded.items():
+            self.candle_store.save(figi, interval, self._to_candle_array(candles), ranges)
+        log.info("Загружено свечей: %s, запросов: %s", sum(len(item[0]) for item in loaded.values()), len(chunks))
+
+    def _to_candle_array(self, candles):
+        """Свечи из ответа API в массив хранилища"""
+        res = np.empty(len(candles), dtype=CANDLE_DTYPE)
+        times = pd.to_datetime([candle.time for candle in candles], utc=True).tz_localize(None)
+        res["time"] = times.to_numpy().astype("datetime64[s]")
+        for field in ("open", "high", "low", "close"):
+            res[field] = money.to_float_array([getattr(candle, field) for candle in candles])
+        res["volume"] = [candle.volume for candle in candles]
+        res["is_complete"] = [candle.is_complete for candle in candles]
+        return res
+
+    def _get_payment_operations(self, operations):
+        return [op for op in operations if op.operation_type in (OperationType(21), OperationType(23))]
+
+    def _get_floater_uids(self, positions):
+        """
+        Множество id позиций флоатеров
+        """
+        return {
+            position.position_uid
+            for position in positions.securities
+            if position.instrument_type == "bond" and self.positions_info[position.figi]["info"].floating_coupon_flag
+        }
+
+    def _get_cached_instrument(self, figi):
+        """
+        Информация об инструменте из памяти или локального кэша. В памяти вместе с ней хранится время загрузки,
+        поэтому для неё действует тот же срок settings.instruments_ttl, что и для кэша.
+        None - если информации нет или она устарела
+        """
+        entry = self.positions_info.get(figi)
+        if entry is not None and time.time() - entry["updated_at"] < settings.instruments_ttl:
+            return entry["info"]
+
+        cached = self.instrument_cache.get(figi)
+        if cached is None or time.time() - cached[1] >= settings.instruments_ttl:
+            return None
+        info, updated_at = cached
+        self.positions_info[figi] = {"info": info, "updated_at": updated_at}
+        return info
+
+    def _store_instrument(self, figi, instrument_type, info):
+        self.instrument_cache.set(figi, instrument_type, info)
+        self.positions_info[figi] = {"info": info, "updated_at": time.time()}
+
+    def get_instrument(self, figi, instrument_type, client):
+        """
+        Получение информации об инструменте: сначала из памяти, затем из локального кэша и только потом через API
+        """
+        info = self._get_cached_instrument(figi)
+        if info is None:
+            info = self._get_instrument_info(client, figi, instrument_type).instrument
+            self._store_instrument(figi, instrument_type, info)
+        return info
+
+    def invalidate_instruments(self, figi=None):
+        """
+        Сброс сохранённой информации об инструменте (или обо всех инструментах, если figi не указан).
+        Снимок портфеля тоже сбрасывается, чтобы следующая загрузка была полной и запросила информацию заново
+        """
+        self.snapshot = None
+        self.valuation = None
+        if figi is None:
+            self.positions_info.clear()
+        else:
+            self.positions_info.pop(figi, None)
+        self.instrument_cache.invalidate(figi)
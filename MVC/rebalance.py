@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from .schema import iter_position_tables
+
+
+def no_sell_total(old_structure, new_structure, whole_money):
+    """
+    Наименьшая стоимость портфеля, при которой для новой структуры ничего не нужно продавать:
+    каждая группа должна поместиться в свою долю, поэтому T = max(whole_money, max old_i / w_i)
+    """
+    return max(
+        [whole_money] + [old_structure.get(pos, 0) / weight for pos, weight in new_structure.items() if weight > 0]
+    )
+
+
+def make_lots_frame(data, lots):
+    """
+    Бумаги всех счетов с группой распределения активов: figi, name, group, count, price, lot.
+    Одна бумага на нескольких счетах объединяется в одну строку
+    """
+    frames = [
+        positions[["figi", "name", "count", "one_price"]].assign(group=group)
+        for account_data in data.values()
+        for _, _, group, positions in iter_position_tables(account_data)
+    ]
+    if not frames:
+        return pd.DataFrame(columns=["figi", "name", "group", "count", "price", "lot"])
+    frame = pd.concat(frames, ignore_index=True)
+    frame = frame.groupby("figi", as_index=False).agg(
+        name=("name", "first"), group=("group", "first"), count=("count", "sum"), price=("one_price", "first")
+    )
+    frame["lot"] = frame["figi"].map(lots).fillna(1).clip(lower=1)
+    return frame
+
+
+def lot_quantities(prices, lots, counts, targets, allow_sell=True):
+    """
+    Целые количества бумаг, кратные лотам, для целевых стоимостей targets: изменение каждой позиции
+    округляется вниз до целого числа лотов, поэтому покупки не выводят ни одну бумагу за её цель, а остаток
+    по каждой бумаге меньше её лота - меньше при таком ограничении остаться не может.
+    Продаются только целые лоты из имеющихся бумаг, без allow_sell количества не уменьшаются
+    """
+    lot_prices = prices * lots
+    tradable = lot_prices > 0
+    safe_prices = np.where(tradable, lot_prices, 1)
+    delta = np.where(tradable, np.floor((targets - counts * prices) / safe_prices), 0)
+    delta = np.maximum(delta, 0 if not allow_sell else -np.floor(counts / lots))  # продать можно только то, что есть
+    remaining = targets.sum() - ((counts + delta * lots) * prices).sum()
+    return counts + delta * lots, remaining
+
+
+def rebalance_by_lots(frame, old_structure, new_structure, whole_money, allow_sell=True):
+    """
+    Сделки для перехода от структуры old_structure (группа -> стоимость) к new_structure (группа -> доля)
+    при стоимости портфеля whole_money. Бумага получает от цели своей группы ту же часть, что сейчас занимает
+    в группе, поэтому часть группы currency, приходящаяся на деньги, и доли групп без бумаг остаются деньгами.
+    Возвращает таблицу бумаг с new_count, lots_delta, money_delta и деньги, которые остаются после сделок
+    """
+    frame = frame.copy()
+    value = frame["count"] * frame["price"]
+    group_value = frame["group"].map(old_structure).fillna(0)
+    group_target = frame["group"].map(new_structure).fillna(0) * whole_money
+    share = np.where(group_value > 0, value / group_value.where(group_value > 0, 1), 0)
+    targets = (group_target * share).to_numpy(dtype=float)
+
+    new_count, _ = lot_quantities(
+        frame["price"].to_numpy(dtype=float),
+        frame["lot"].to_numpy(dtype=float),
+        frame["count"].to_numpy(dtype=float),
+        targets,
+        allow_sell,
+    )
+    frame["target"] = targets
+    frame["new_count"] = new_count
+    frame["lots_delta"] = (new_count - frame["count"]) / frame["lot"]
+    frame["money_delta"] = (new_count - frame["count"]) * frame["price"]
+    cash = whole_money - float((new_count * frame["price"]).sum())
+    return frame, cash
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+# Границы поиска ставки XIRR бисекцией, если метод Ньютона не сошёлся
+XIRR_BOUNDS = (-0.9999, 100.0)
+DAYS_IN_YEAR = 365.25
+
+
+def _npv(rates, amounts, years, groups, count):
+    return np.bincount(groups, weights=amounts * (1 + rates[groups]) ** -years, minlength=count)
+
+
+def xirr(amounts, years, groups, count, iterations=50, tolerance=1e-9):
+    """
+    Годовые ставки XIRR сразу для count групп потоков: amounts - суммы (вложения со знаком минус),
+    years - время потока в годах, groups - номер группы каждого потока.
+    Все группы решаются одновременно методом Ньютона, несошедшиеся - бисекцией на XIRR_BOUNDS.
+    Для групп без потоков обоих знаков и без корня на XIRR_BOUNDS возвращается nan
+    """
+    valid = (np.bincount(groups, weights=amounts > 0, minlength=count) > 0) & (
+        np.bincount(groups, weights=amounts < 0, minlength=count) > 0
+    )
+    scale = np.bincount(groups, weights=np.abs(amounts), minlength=count)
+    rates = np.full(count, 0.1)
+    with np.errstate(all="ignore"):
+        for _ in range(iterations):
+            growth = 1 + rates[groups]
+            discount = growth**-years
+            npv = np.bincount(groups, weights=amounts * discount, minlength=count)
+            slope = np.bincount(groups, weights=-years * amounts * discount / growth, minlength=count)
+            step = np.where(slope != 0, npv / slope, 0)
+            rates = np.clip(rates - step, *XIRR_BOUNDS)
+            if np.all((np.abs(step) < tolerance) | ~valid):
+                break
+        solved = valid & (np.abs(_npv(rates, amounts, years, groups, count)) <= tolerance * scale)
+
+        low = np.full(count, XIRR_BOUNDS[0])
+        high = np.full(count, XIRR_BOUNDS[1])
+        npv_low = _npv(low, amounts, years, groups, count)
+        bracketed = valid & ~solved & (np.sign(npv_low) != np.sign(_npv(high, amounts, years, groups, count)))
+        for _ in range(100):
+            mid = (low + high) / 2
+            npv_mid = _npv(mid, amounts, years, groups, count)
+            left = np.sign(npv_mid) == np.sign(npv_low)
+            low = np.where(left, mid, low)
+            npv_low = np.where(left, npv_mid, npv_low)
+            high = np.where(left, high, mid)
+    return np.where(solved, rates, np.where(bracketed, (low + high) / 2, np.nan))
+
+
+def time_weighted(values, inflows, outflows, income):
+    """
+    Доходность TWR за весь период для каждого столбца матриц день x группа. Потоки считаются прошедшими
+    в конце дня, кроме вложений в день открытия позиции: тогда доходность дня считается от вложенной суммы.
+    Дни без позиции и без вложений пропускаются
+    """
+    previous = np.vstack([np.zeros((1, values.shape[1])), values[:-1]])
+    opening = previous <= 0
+    base = np.where(opening, inflows, previous)
+    closing = values + outflows + income - np.where(opening, 0, inflows)
+    with np.errstate(all="ignore"):
+        growth = np.where(base > 0, closing / base, 1)
+    return growth.prod(axis=0) - 1
+
+
+def account_returns(replay, instrument_types, names):
+    """
+    XIRR и TWR счёта, видов активов и бумаг по восстановленному счёту: таблица со столбцами level
+    (account, asset, instrument), key, name, value, xirr, twr, доходности в процентах.
+    instrument_types и names - тип и название бумаги по figi.
+    Потоки бумаги - сделки и выплаты по ней и стоимость позиции на последний день, потоки счёта - пополнения
+    и выводы и стоимость счёта. Все группы считаются одним вызовом xirr и одним вызовом time_weighted
+    """
+    days = len(replay.days)
+    figis = list(replay.figis)
+    assets = sorted({instrument_types.get(figi, "other") for figi in figis})
+    asset_of = np.array([assets.index(instrument_types.get(figi, "other")) for figi in figis], dtype=int)
+    membership = np.zeros((len(figis), len(assets)))
+    membership[np.arange(len(figis)), asset_of] = 1
+
+    # потоки по бумагам, день x figi: покупки, продажи и прочие платежи (выплаты, налоги, комиссии)
+    has_figi = replay.column >= 0
+    trade = has_figi & (replay.signs != 0)
+    other = has_figi & (replay.signs == 0)
+    inflows = np.zeros((days, len(figis)))
+    outflows = np.zeros((days, len(figis)))
+    income = np.zeros((days, len(figis)))
+    np.add.at(inflows, (replay.day_idx[trade], replay.column[trade]), np.maximum(-replay.payments[trade], 0))
+    np.add.at(outflows, (replay.day_idx[trade], replay.column[trade]), np.maximum(replay.payments[trade], 0))
+    np.add.at(income, (replay.day_idx[other], replay.column[other]), replay.payments[other])
+
+    values = replay.values
+    account_value = (replay.cash + values.sum(axis=1))[:, None]
+    capital = np.where(replay.is_capital, replay.payments, 0)
+    account_inflows = np.bincount(replay.day_idx, weights=np.maximum(capital, 0), minlength=days)[:, None]
+    account_outflows = np.bincount(replay.day_idx, weights=np.maximum(-capital, 0), minlength=days)[:, None]
+    twr = time_weighted(
+        np.hstack([account_value, values @ membership, values]),
+        np.hstack([account_inflows, inflows @ membership, inflows]),
+        np.hstack([account_outflows, outflows @ membership, outflows]),
+        np.hstack([np.zeros((days, 1)), income @ membership, income]),
+    )
+
+    # группы XIRR: 0 - счёт, затем виды активов, затем бумаги
+    count = 1 + len(assets) + len(figis)
+    flows = np.flatnonzero(has_figi)
+    final_values = np.concatenate([account_value[-1], values[-1] @ membership, values[-1]])
+    amounts = np.concatenate(
+        [
+            -capital[replay.is_capital],
+            replay.payments[flows],
+            replay.payments[flows],
+            final_values,
+        ]
+    )
+    groups = np.concatenate(
+        [
+            np.zeros(replay.is_capital.sum(), dtype=int),
+            1 + asset_of[replay.column[flows]],
+            1 + len(assets) + replay.column[flows],
+            np.arange(count),
+        ]
+    )
+    flow_days = np.concatenate(
+        [replay.day_idx[replay.is_capital], replay.day_idx[flows], replay.day_idx[flows], np.full(count, days - 1)]
+    )
+    rates = xirr(amounts, flow_days / DAYS_IN_YEAR, groups, count)
+
+    return pd.DataFrame(
+        {
+            "level": ["account"] + ["asset"] * len(assets) + ["instrument"] * len(figis),
+            "key": [""] + assets + figis,
+            "name": [""] + assets + [names.get(figi, figi) for figi in figis],
+            "value": final_values,
+            "xirr": rates * 100,
+            "twr": twr * 100,
+        }
+    )
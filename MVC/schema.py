@@ -0,0 +1,15 @@
+# Ключи данных счёта, которые не являются видами активов
+NON_ASSET_KEYS = ("whole_price", "calendar")
+# Таблицы позиций облигаций и группа распределения активов, в которую входит их стоимость,
+# у остальных видов активов таблица positions и группа совпадает с видом актива
+BOND_GROUPS = {"regular_positions": "regular_bond", "floater_positions": "floater_bond"}
+
+
+def iter_position_tables(account_data):
+    """Таблицы позиций счёта: (вид актива, ключ таблицы, группа распределения активов, таблица позиций)"""
+    for instrument_type, asset in account_data.items():
+        if instrument_type in NON_ASSET_KEYS:
+            continue
+        keys = BOND_GROUPS if instrument_type == "bond" else {"positions": instrument_type}
+        for key, group in keys.items():
+            yield instrument_type, key, group, asset[key]
@@ -0,0 +1,147 @@
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from .schema import iter_position_tables
+
+# Столбцы таблицы позиций, которые зависят от последней цены
+PRICE_COLUMNS = [
+    "last_price",
+    "one_price",
+    "whole_price",
+    "cost",
+    "buy_profit",
+    "profit_percent",
+    "coupons_profit_percent",
+    "dividend_profit_percent",
+    "full_profit_percent",
+    "total_profit",
+]
+# Таблицы позиций облигаций: ключ в данных счёта -> ключ итога стоимости
+BOND_POSITION_KEYS = {"regular_positions": "regular_price", "floater_positions": "floater_price"}
+# Распределения стоимости вида актива по группам: ключ в данных счёта -> столбец таблицы позиций
+GROUP_COLUMNS = {"sector": "sector", "focus_type": "focus_type"}
+
+
+def compute_price_columns(frame):
+    """
+    Расчёт столбцов, зависящих от цены, для всех строк frame (таблицы позиций или её части)
+    """
+    is_bond = frame["instrument_type"] == "bond"
+    frame["one_price"] = np.where(is_bond, frame["last_price"] / 100 * frame["nominal"], frame["last_price"])
+    frame["whole_price"] = frame["one_price"] * frame["count"]
+    frame["cost"] = frame["avr_price"] * frame["count"]
+    frame["buy_profit"] = (frame["one_price"] - frame["avr_price"]) * frame["count"]
+
+    cost = frame["cost"].where(frame["cost"] > 0)
+    whole = frame["whole_price"].where(frame["whole_price"] > 0)
+    frame["profit_percent"] = (frame["buy_profit"] / cost * 100).fillna(0)
+    frame["coupons_profit_percent"] = (frame["coupons"] / cost * 100).fillna(0)
+    frame["dividend_profit_percent"] = (frame["dividend"] / whole * 100).fillna(0)
+    frame["full_profit_percent"] = np.where(
+        is_bond,
+        ((frame["buy_profit"] + frame["coupons"]) / cost * 100).fillna(0),
+        frame["profit_percent"] + frame["dividend_profit_percent"],
+    )
+    frame["total_profit"] = frame["coupons_future_profit"] + frame["buy_profit"] + frame["coupons"]
+    return frame
+
+
+class PortfolioValuation:
+    """
+    Данные счетов с отслеживанием зависимостей от цен: для каждого figi известны строки таблиц позиций
+    и итоги, в которые входит их стоимость. Новые цены пересчитывают только строки изменившихся бумаг,
+    итоги их видов активов, секторов и фокусов и общую стоимость счёта. Курсы валют тоже входят в цены:
+    счета, в которых есть валюта с новым курсом, пересчитываются целиком по сохранённым исходным данным.
+    Данные не меняются на месте, затронутые словари и таблицы копируются, поэтому данные,
+    выданные до переоценки, остаются прежними
+    """
+
+    def __init__(self, data, holdings, sources, currencies):
+        """
+        data - id счёта -> данные счёта, holdings - id счёта -> состав счёта, при котором данные верны,
+        sources - id счёта -> исходные данные для пересчёта счёта без запросов к API,
+        currencies - id счёта -> валюты, курсы которых входят в данные счёта
+        """
+        self.data = data
+        self.holdings = holdings
+        self.sources = sources
+        self.currencies = currencies
+        self.built_at = time.time()
+        self._index()
+
+    def _index(self):
+        # figi -> [(счёт, вид актива, ключ таблицы позиций, индекс строки)]
+        self.rows = defaultdict(list)
+        for account_id, account_data in self.data.items():
+            for instrument_type, key, _, positions in iter_position_tables(account_data):
+                for idx, figi in zip(positions.index, positions["figi"]):
+                    self.rows[figi].append((account_id, instrument_type, key, idx))
+
+    @property
+    def figis(self):
+        return list(self.rows)
+
+    def get_accounts_with(self, currencies):
+        """Счета, в данные которых входит хотя бы одна из валют currencies"""
+        return [account_id for account_id, used in self.currencies.items() if used & set(currencies)]
+
+    def replace_accounts(self, accounts):
+        """Замена данных счетов, пересчитанных заново: id счёта -> данные счёта"""
+        self.data = {**self.data, **accounts}
+        self._index()
+
+    def reprice(self, prices):
+        """
+        Применение новых цен figi -> цена, возвращает число бумаг, цена которых изменилась
+        """
+        changed = defaultdict(dict)  # (счёт, вид актива, ключ таблицы) -> индекс строки -> цена
+        changed_figis = set()
+        for figi, price in prices.items():
+            for account_id, instrument_type, key, idx in self.rows.get(figi, ()):
+                if self.data[account_id][instrument_type][key].at[idx, "last_price"] != price:
+                    changed[account_id, instrument_type, key][idx] = price
+                    changed_figis.add(figi)
+        if not changed:
+            return 0
+
+        data = dict(self.data)
+        copied = set()
+        for (account_id, instrument_type, key), row_prices in changed.items():
+            if account_id not in copied:
+                data[account_id] = dict(data[account_id])
+                copied.add(account_id)
+            if (account_id, instrument_type) not in copied:
+                asset = dict(data[account_id][instrument_type])
+                for group in GROUP_COLUMNS:
+                    if group in asset:
+                        asset[group] = dict(asset[group])
+                data[account_id][instrument_type] = asset
+                copied.add((account_id, instrument_type))
+            self._reprice_rows(data[account_id], instrument_type, key, row_prices)
+        self.data = data
+        return len(changed_figis)
+
+    def _reprice_rows(self, account_data, instrument_type, key, row_prices):
+        asset = account_data[instrument_type]
+        positions = asset[key].copy()
+        asset[key] = positions
+        idxs = list(row_prices)
+        before = positions.loc[idxs, ["whole_price", "buy_profit"]]
+        positions.loc[idxs, "last_price"] = list(row_prices.values())
+        rows = compute_price_columns(positions.loc[idxs].copy())
+        positions.loc[idxs, PRICE_COLUMNS] = rows[PRICE_COLUMNS]
+
+        whole_delta = rows["whole_price"] - before["whole_price"]
+        profit_delta = rows["buy_profit"] - before["buy_profit"]
+        asset["total_price"] += float(whole_delta.sum())
+        if "buy_profit" in asset:
+            asset["buy_profit"] += float(profit_delta.sum())
+        if key in BOND_POSITION_KEYS:
+            asset[BOND_POSITION_KEYS[key]] += float(whole_delta.sum())
+        for group, column in GROUP_COLUMNS.items():
+            if group in asset:
+                for name, delta in whole_delta.groupby(rows[column]).sum().items():
+                    asset[group][name] = asset[group].get(name, 0) + float(delta)
+        account_data["whole_price"] += float(whole_delta.sum())
@@ -1,4 +1,5 @@
 import datetime
+import math
 import os
 from time import sleep
 
@@ -7,8 +8,68 @@ from xlsxwriter.utility import xl_rowcol_to_cell
 
 from logger.logger import get_logger
 
+from .schema import NON_ASSET_KEYS
+
 log = get_logger()
 
+# Столбцы таблицы позиций модели в порядке вывода на листах
+REGULAR_BOND_COLUMNS = [
+    "name",
+    "coupon_per",
+    "one_price",
+    "count",
+    "whole_price",
+    "avr_price",
+    "coupons_percent",
+    "coupons",
+    "days_before_maturity",
+    "coupons_profit_percent",
+    "full_profit_percent",
+    "coupons_future_profit",
+    "buy_profit",
+    "total_profit",
+    "amortization",
+    "placement_date",
+    "maturity_date",
+    "country",
+    "nominal",
+    "name",
+]
+FLOATER_BOND_COLUMNS = [
+    "name",
+    "coupon_per",
+    "one_price",
+    "count",
+    "whole_price",
+    "avr_price",
+    "coupons",
+    "days_before_maturity",
+    "coupons_profit_percent",
+    "full_profit_percent",
+    "amortization",
+    "placement_date",
+    "maturity_date",
+    "country",
+    "nominal",
+    "name",
+]
+SHARE_COLUMNS = [
+    "name",
+    "country",
+    "one_price",
+    "count",
+    "whole_price",
+    "avr_price",
+    "profit_percent",
+    "dividend",
+    "dividend_profit_percent",
+    "full_profit_percent",
+    "div_price",
+    "div_date",
+]
+ETF_COLUMNS = ["name", "one_price", "count", "whole_price", "avr_price", "profit_percent", "buy_profit", "focus_type"]
+OTHER_COLUMNS = ["name", "one_price", "count", "whole_price"]
+
 
 class View:
     def __init__(self):
@@ -19,43 +80,74 @@ class View:
             "regular": "обычным",
             "floater": "плавающим",
             "whole_price": "Общая_информация",
+            "calendar": "Календарь",
+            "coupon": "Купоны",
+            "dividend": "Дивиденды",
+            "amortization": "Амортизация",
+            "redemption": "Погашения",
+            "total": "Итого",
+            "history": "История",
+            "value_history": "Стоимость",
+            "returns": "Доходность",
+            "account": "Счёт",
+            "asset": "Вид актива",
+            "instrument": "Бумага",
         }
         self.HEADER_FORMAT = None
         self.TABLE_HEADER_FORMAT = None
         self.EVEN_FORMAT = None  # четная строка
         self.ODD_FORMAT = None  # нечетная строка
 
-    def make_report(self, data):
+    def make_report(
+        self,
+        data,
+        diagnostics=None,
+        history=None,
+        streaming=False,
+        value_history=None,
+        returns=None,
+        account_names=None,
+    ):
+        """
+        Excel отчет по счетам, data - id счёта -> данные счёта, diagnostics - статистика вызовов API для листа
+        "Диагностика", history - id счёта -> строки истории операций, value_history - id счёта -> дневная стоимость
+        и вложенный капитал, returns - id счёта -> доходность XIRR и TWR, account_names - id счёта -> название.
+        При streaming строки сразу сбрасываются на диск (constant_memory), поэтому каждый лист заполняется
+        строго сверху вниз
+        """
         try:
             log.info("Начинаю создавать отчет...")
-            os.makedirs("/results", exist_ok=True)
+            os.makedirs("results", exist_ok=True)
 
             workbook = xlsxwriter.Workbook(
-                f"results/report_{datetime.datetime.now().strftime("%Y-%m-%d_%H_%M_%S")}.xlsx"
+                f"results/report_{datetime.datetime.now().strftime("%Y-%m-%d_%H_%M_%S")}.xlsx",
+                {"constant_memory": streaming},
             )
             self.HEADER_FORMAT = workbook.add_format({"bold": True, "bg_color": "#D3D3D3", "border": 1})
             self.TABLE_HEADER_FORMAT = workbook.add_format({"bold": True, "bg_color": "#6699ff", "border": 1})
             self.EVEN_FORMAT = workbook.add_format({"bg_color": "#ffffff", "border": 1})
             self.ODD_FORMAT = workbook.add_format({"bg_color": "#dbe9f9", "border": 1})
 
-            general_information = {}
-
-            for instrument_type in data:
-                name = self.translate.get(instrument_type, instrument_type)
-                worksheet = workbook.add_worksheet(name=name)
-                if instrument_type == "bond":
-                    self._make_bond_worksheet(data["bond"], worksheet, workbook, data["whole_price"], name)
-                elif instrument_type == "share":
-                    self._make_share_worksheet(data["share"], worksheet, workbook, data["whole_price"], name)
-                elif instrument_type == "etf":
-                    self._make_etf_worksheet(data["etf"], worksheet, workbook, data["whole_price"], name)
-                elif instrument_type == "whole_price":
-                    self._make_general_worksheet(general_information, worksheet, workbook, data["whole_price"], name)
-                    break
-                else:
-                    self._make_other_worksheet(data[instrument_type], worksheet, data["whole_price"])
-
-                general_information[instrument_type] = data[instrument_type]["total_price"]
+            several_accounts = len(data) > 1
+            for account_idx, (account_id, account_data) in enumerate(data.items(), start=1):
+                suffix = f" {account_idx}" if several_accounts else ""
+                self._make_account_worksheets(account_data, workbook, suffix)
+                if history and account_id in history:
+                    worksheet = workbook.add_worksheet(name=self.translate["history"] + suffix)
+                    self._make_history_worksheet(history[account_id], worksheet)
+                if value_history and account_id in value_history:
+                    name = self.translate["value_history"] + suffix
+                    worksheet = workbook.add_worksheet(name=name)
+                    self._make_value_history_worksheet(value_history[account_id], worksheet, workbook, name)
+                if returns and account_id in returns:
+                    worksheet = workbook.add_worksheet(name=self.translate["returns"] + suffix)
+                    self._make_returns_worksheet(returns[account_id], worksheet)
+            if several_accounts:
+                worksheet = workbook.add_worksheet(name="Сводка")
+                self._make_consolidated_worksheet(data, worksheet, workbook, "Сводка", account_names or {})
+            if diagnostics:
+                worksheet = workbook.add_worksheet(name="Диагностика")
+                self._make_diagnostics_worksheet(diagnostics, worksheet)
 
             workbook.close()
 
@@ -66,6 +158,185 @@ class View:
             log.error("Ошибка во время создания отчета, %s", str(e))
             return "error"
 
+    def _make_account_worksheets(self, data, workbook, suffix):
+        general_information = {}
+
+        for instrument_type in data:
+            name = self.translate.get(instrument_type, instrument_type) + suffix
+            worksheet = workbook.add_worksheet(name=name)
+            if instrument_type == "bond":
+                self._make_bond_worksheet(data["bond"], worksheet, workbook, data["whole_price"], name)
+            elif instrument_type == "share":
+                self._make_share_worksheet(data["share"], worksheet, workbook, data["whole_price"], name)
+            elif instrument_type == "etf":
+                self._make_etf_worksheet(data["etf"], worksheet, workbook, data["whole_price"], name)
+            elif instrument_type == "whole_price":
+                self._make_general_worksheet(general_information, worksheet, workbook, data["whole_price"], name)
+                break
+            else:
+                self._make_other_worksheet(data[instrument_type], worksheet, data["whole_price"])
+
+            general_information[instrument_type] = data[instrument_type]["total_price"]
+
+        if "calendar" in data:
+            name = self.translate["calendar"] + suffix
+            worksheet = workbook.add_worksheet(name=name)
+            self._make_calendar_worksheet(data["calendar"], worksheet, workbook, name)
+
+    def _make_calendar_worksheet(self, calendar, worksheet, workbook, worksheet_name):
+        """Помесячный календарь ожидаемых выплат с гистограммой по видам выплат"""
+        worksheet.set_column("A:F", 16)
+        worksheet.write(0, 0, "Ожидаемые выплаты по месяцам", self.HEADER_FORMAT)
+        worksheet.write_row(
+            1, 0, ["Месяц"] + [self.translate.get(name, name) for name in calendar.columns], self.TABLE_HEADER_FORMAT
+        )
+        cur_row = 2
+        even_row = True
+        for month, row in zip(calendar.index, calendar.round(2).itertuples(index=False)):
+            worksheet.write_row(cur_row, 0, [month, *row], self.EVEN_FORMAT if even_row else self.ODD_FORMAT)
+            cur_row += 1
+            even_row = not even_row
+
+        chart = workbook.add_chart({"type": "column", "subtype": "stacked"})
+        for col in range(1, len(calendar.columns)):  # без столбца "Итого"
+            chart.add_series(
+                {
+                    "name": [worksheet_name, 1, col],
+                    "categories": [worksheet_name, 2, 0, cur_row - 1, 0],
+                    "values": [worksheet_name, 2, col, cur_row - 1, col],
+                }
+            )
+        chart.set_title({"name": "Календарь выплат"})
+        worksheet.insert_chart("H2", chart)
+
+    def _make_consolidated_worksheet(self, data, worksheet, workbook, worksheet_name, account_names):
+        """Сводные итоги по всем счетам, номер счёта совпадает с номером в названиях листов"""
+        instrument_types = []
+        for account_data in data.values():
+            for instrument_type in account_data:
+                if instrument_type not in NON_ASSET_KEYS and instrument_type not in instrument_types:
+                    instrument_types.append(instrument_type)
+
+        worksheet.set_column("A:B", 22)
+        worksheet.write(0, 0, "Сводка по счетам", self.HEADER_FORMAT)
+        worksheet.write_row(
+            1,
+            0,
+            ["№", "Счёт"] + [self.translate.get(name, name) for name in instrument_types] + ["Валюта", "Общая стоимость"],
+            self.TABLE_HEADER_FORMAT,
+        )
+        totals = [0] * (len(instrument_types) + 2)
+        cur_row = 2
+        for account_idx, (account_id, account_data) in enumerate(data.items(), start=1):
+            values = [account_data.get(name, {}).get("total_price", 0) for name in instrument_types]
+            values.append(account_data["whole_price"] - sum(values))
+            values.append(account_data["whole_price"])
+            totals = [total + value for total, value in zip(totals, values)]
+            fmt = self.EVEN_FORMAT if account_idx % 2 else self.ODD_FORMAT
+            row = [account_idx, account_names.get(account_id, account_id)] + [round(value, 2) for value in values]
+            worksheet.write_row(cur_row, 0, row, fmt)
+            cur_row += 1
+        worksheet.write_row(
+            cur_row, 0, ["", "Итого"] + [round(value, 2) for value in totals], self.TABLE_HEADER_FORMAT
+        )
+
+        self._make_pie(
+            worksheet,
+            worksheet_name,
+            workbook,
+            [2, 1],
+            [cur_row - 1, 1],
+            [2, len(totals) + 1],
+            [cur_row - 1, len(totals) + 1],
+            f"B{cur_row + 3}",
+            "Распределение по счетам",
+        )
+
+    def _make_history_worksheet(self, rows, worksheet):
+        """История операций: строки берутся из генератора и записываются по одной"""
+        worksheet.set_column("A:A", 20)
+        worksheet.set_column("B:C", 30)
+        worksheet.set_column("D:H", 14)
+        worksheet.write(0, 0, "История операций", self.HEADER_FORMAT)
+        worksheet.write_row(
+            1,
+            0,
+            ["Дата", "Операция", "Инструмент", "FIGI", "Кол-во", "Цена", "Сумма", "Валюта"],
+            self.TABLE_HEADER_FORMAT,
+        )
+        even_row = True
+        for cur_row, row in enumerate(rows, start=2):
+            worksheet.write_row(cur_row, 0, row, self.EVEN_FORMAT if even_row else self.ODD_FORMAT)
+            even_row = not even_row
+
+    def _make_value_history_worksheet(self, history, worksheet, workbook, worksheet_name):
+        """Дневная стоимость счёта и вложенный капитал с линейным графиком"""
+        worksheet.set_column("A:C", 16)
+        worksheet.write(0, 0, "Стоимость счёта по дням", self.HEADER_FORMAT)
+        worksheet.write_row(1, 0, ["Дата", "Стоимость", "Вложено"], self.TABLE_HEADER_FORMAT)
+        cur_row = 2
+        even_row = True
+        for date, value, invested in zip(
+            history.index.strftime("%Y-%m-%d"), history["value"].round(2), history["invested"].round(2)
+        ):
+            worksheet.write_row(cur_row, 0, [date, value, invested], self.EVEN_FORMAT if even_row else self.ODD_FORMAT)
+            cur_row += 1
+            even_row = not even_row
+
+        chart = workbook.add_chart({"type": "line"})
+        for col in (1, 2):
+            chart.add_series(
+                {
+                    "name": [worksheet_name, 1, col],
+                    "categories": [worksheet_name, 2, 0, cur_row - 1, 0],
+                    "values": [worksheet_name, 2, col, cur_row - 1, col],
+                }
+            )
+        chart.set_title({"name": "Стоимость счёта"})
+        chart.set_x_axis({"num_font": {"rotation": -45}})
+        chart.set_size({"width": 960, "height": 480})
+        worksheet.insert_chart("E2", chart)
+
+    def _make_returns_worksheet(self, returns, worksheet):
+        """
+        Доходность счёта, видов активов и бумаг с учётом времени вложений: XIRR - годовая доходность денежных
+        потоков, TWR - доходность за весь период без влияния пополнений и выводов
+        """
+        worksheet.set_column("A:A", 14)
+        worksheet.set_column("B:B", 40)
+        worksheet.set_column("C:E", 16)
+        worksheet.write(0, 0, "Доходность с учётом времени вложений", self.HEADER_FORMAT)
+        worksheet.write_row(
+            1, 0, ["Уровень", "Название", "Стоимость", "XIRR, % годовых", "TWR, % за период"], self.TABLE_HEADER_FORMAT
+        )
+        even_row = True
+        for cur_row, row in enumerate(returns.itertuples(index=False), start=2):
+            values = [
+                self.translate.get(row.level, row.level),
+                self.translate.get(row.name, row.name),
+                round(row.value, 2),
+                *("" if math.isnan(value) else round(value, 2) for value in (row.xirr, row.twr)),
+            ]
+            worksheet.write_row(cur_row, 0, values, self.EVEN_FORMAT if even_row else self.ODD_FORMAT)
+            even_row = not even_row
+
+    def _make_diagnostics_worksheet(self, diagnostics, worksheet):
+        """Число вызовов, ошибки, время и гистограмма задержек по методам API"""
+        histogram = list(next(iter(diagnostics.values()))["histogram"])
+        worksheet.set_column("A:A", 36)
+        worksheet.set_column(1, 5 + len(histogram), 12)
+        worksheet.write(0, 0, "Вызовы API", self.HEADER_FORMAT)
+        worksheet.write_row(
+            1,
+            0,
+            ["Метод", "Вызовов", "Ошибок", "Всего, мс", "Среднее, мс", "Максимум, мс"] + histogram,
+            self.TABLE_HEADER_FORMAT,
+        )
+        for idx, (method, stats) in enumerate(diagnostics.items()):
+            values = [stats[key] for key in ("count", "errors", "total_ms", "mean_ms", "max_ms")]
+            fmt = self.EVEN_FORMAT if idx % 2 == 0 else self.ODD_FORMAT
+            worksheet.write_row(idx + 2, 0, [method, *values, *stats["histogram"].values()], fmt)
+
     def _make_bond_worksheet(self, data, worksheet, workbook, whole_price, worksheet_name):
         width = {
             "A": 22,
@@ -91,12 +362,21 @@ class View:
         for i in width:
             worksheet.set_column(f"{i}:{i}", width[i])
 
+        # данные для диаграмм пишутся вместе с первыми строками, чтобы лист заполнялся сверху вниз
+        cur_col = 21
+        sector_names = [sector.strip().capitalize() for sector in data["sector"]]
+        sector_nums = list(data["sector"].values())
+
         worksheet.write(0, 0, "Общая информация", self.HEADER_FORMAT)
+        worksheet.write_row(0, cur_col, sector_names)
         worksheet.write_row(1, 0, ["Общая стоимость", round(data["total_price"], 2)])
+        worksheet.write_row(1, cur_col, sector_nums)
         worksheet.write_row(2, 0, ["Общее количество", data["total_amount"]])
+        worksheet.write_row(2, cur_col, ["Обычные", "Плавающие"])
         worksheet.write_row(
             3, 0, ["Доля от портфеля", round(data["total_price"] / whole_price, 2) if whole_price > 0 else 0]
         )
+        worksheet.write_row(3, cur_col, [data["regular_price"], data["floater_price"]])
         worksheet.write_row(4, 0, ["Общая сумма купонов", round(data["floater_coupon"] + data["regular_coupon"], 2)])
 
         floater_names = [
@@ -191,107 +471,19 @@ class View:
                 worksheet.write_row(cur_row, 0, regular_names, cell_format=self.TABLE_HEADER_FORMAT)
             else:
                 worksheet.write_row(cur_row, 0, floater_names, cell_format=self.TABLE_HEADER_FORMAT)
-            even_row = True
-            for pos in data[f"{bond_type}_positions"]:
-                cur_row += 1
-                profit = round(
-                    (
-                        pos["coupons"] / (pos["avr_price"] * pos["count"]) * 100
-                        if pos["avr_price"] * pos["count"] > 0
-                        else 0
-                    ),
-                    2,
-                )
-                full_profit = round(
-                    (
-                        ((pos["whole_price"] + pos["coupons"]) - (pos["avr_price"] * pos["count"]))
-                        / (pos["avr_price"] * pos["count"])
-                        * 100
-                        if pos["avr_price"] * pos["count"] > 0
-                        else 0
-                    ),
-                    2,
-                )
-
-                if even_row:
-                    fmt = self.EVEN_FORMAT
-                else:
-                    fmt = self.ODD_FORMAT
-
-                pos["one_price"] = round(pos["one_price"], 2)
-                pos["whole_price"] = round(pos["whole_price"], 2)
-                pos["avr_price"] = round(pos["avr_price"], 2)
-                if bond_type == "regular":
-                    pos["coupons_future_profit"] = round(pos["coupons_future_profit"], 2)
-                    pos["buy_profit"] = round(pos["buy_profit"], 2)
-                    worksheet.write_row(
-                        cur_row,
-                        0,
-                        [
-                            pos["name"],
-                            pos["coupon_per"],
-                            pos["one_price"],
-                            pos["count"],
-                            pos["whole_price"],
-                            pos["avr_price"],
-                            pos["coupons_percent"],
-                            pos["coupons"],
-                            pos["days_before_maturity"],
-                            profit,
-                            full_profit,
-                            pos["coupons_future_profit"],
-                            pos["buy_profit"],
-                            round(pos["coupons_future_profit"] + pos["buy_profit"] + pos["coupons"], 2),
-                            pos["amortization"],
-                            pos["placement_date"].strftime("%Y-%m-%d"),
-                            pos["maturity_date"].strftime("%Y-%m-%d"),
-                            pos["country"],
-                            pos["nominal"],
-                            pos["name"],
-                        ],
-                        fmt,
-                    )
-                else:
-                    worksheet.write_row(
-                        cur_row,
-                        0,
-                        [
-                            pos["name"],
-                            pos["coupon_per"],
-                            pos["one_price"],
-                            pos["count"],
-                            pos["whole_price"],
-                            pos["avr_price"],
-                            pos["coupons"],
-                            pos["days_before_maturity"],
-                            profit,
-                            full_profit,
-                            pos["amortization"],
-                            pos["placement_date"].strftime("%Y-%m-%d"),
-                            pos["maturity_date"].strftime("%Y-%m-%d"),
-                            pos["country"],
-                            pos["nominal"],
-                            pos["name"],
-                        ],
-                        fmt,
-                    )
-                even_row = not even_row
+            positions = data[f"{bond_type}_positions"]
+            positions = positions.assign(
+                placement_date=positions["placement_date"].dt.strftime("%Y-%m-%d"),
+                maturity_date=positions["maturity_date"].dt.strftime("%Y-%m-%d"),
+            )
             if bond_type == "regular":
+                cur_row = self._write_positions(worksheet, positions, REGULAR_BOND_COLUMNS, cur_row + 1)
                 worksheet.write_row(cur_row, 0, regular_names, cell_format=self.TABLE_HEADER_FORMAT)
             else:
+                cur_row = self._write_positions(worksheet, positions, FLOATER_BOND_COLUMNS, cur_row + 1)
                 worksheet.write_row(cur_row, 0, floater_names, cell_format=self.TABLE_HEADER_FORMAT)
             cur_row += 1
 
-        cur_col = 21
-        sector_names = []
-        sector_nums = []
-        for sector in data["sector"]:
-            sector_names.append(sector)
-            sector_nums.append(data["sector"][sector])
-        sector_names = list(map(lambda x: x.strip().capitalize(), sector_names))
-        worksheet.write_row(0, cur_col, sector_names)
-        worksheet.write_row(1, cur_col, sector_nums)
-
         self._make_pie(
             worksheet,
             worksheet_name,
@@ -304,18 +496,14 @@ class View:
             "Распределение по секторам",
         )
 
-        cur_row = 20
-        worksheet.write_row(cur_row, cur_col, ["Обычные", "Плавающие"])
-        worksheet.write_row(cur_row + 1, cur_col, [data["regular_price"], data["floater_price"]])
-
         self._make_pie(
             worksheet,
             worksheet_name,
             workbook,
-            [cur_row, cur_col],
-            [cur_row, cur_col + 1],
-            [cur_row + 1, cur_col],
-            [cur_row + 1, cur_col + 1],
+            [2, cur_col],
+            [2, cur_col + 1],
+            [3, cur_col],
+            [3, cur_col + 1],
             "V25",
             "Распределение облигаций",
         )
@@ -325,8 +513,14 @@ class View:
         for i in width:
             worksheet.set_column(f"{i}:{i}", width[i])
 
+        cur_col = 14
+        sector_names = [sector.strip().capitalize() for sector in data["sector"]]
+        sector_nums = list(data["sector"].values())
+
         worksheet.write(0, 0, "Общая информация", self.HEADER_FORMAT)
+        worksheet.write_row(0, cur_col, sector_names)
         worksheet.write_row(1, 0, ["Общая стоимость", data["total_price"]])
+        worksheet.write_row(1, cur_col, sector_nums)
         worksheet.write_row(2, 0, ["Общее количество", data["total_amount"]])
         worksheet.write_row(
             3, 0, ["Доля в портфеле", round(data["total_price"] / whole_price if whole_price > 0 else 0, 2)]
@@ -343,7 +537,19 @@ class View:
         worksheet.write_row(6, 0, ["Доходность покупок", data["buy_profit"]])
         worksheet.write_row(7, 0, ["Общая доходность, Р", data["buy_profit"] + data["dividend"]])
         worksheet.write_row(
-            7, 0, ["Общая доходность, %", round((data["buy_profit"] + data["dividend"]) / data["total_price"] * 100, 2)]
+            7,
+            0,
+            [
+                "Общая доходность, %",
+                round(
+                    (
+                        (data["buy_profit"] + data["dividend"]) / data["total_price"] * 100
+                        if data["total_price"] > 0
+                        else 0
+                    ),
+                    2,
+                ),
+            ],
         )
 
         worksheet.write(9, 0, "Информация по позициям", self.HEADER_FORMAT)
@@ -366,59 +572,7 @@ class View:
             ],
             self.TABLE_HEADER_FORMAT,
         )
-        cur_row = 11
-
-        even_row = True
-        for pos in data["positions"]:
-            profit = (
-                round(
-                    (
-                        pos["whole_price"] / (pos["avr_price"] * pos["count"]) * 100
-                        if pos["avr_price"] * pos["count"]
-                        else 0
-                    ),
-                    2,
-                )
-                - 100
-            )
-            div_profit = round(pos["dividend"] / pos["whole_price"] * 100 if pos["whole_price"] > 0 else 0, 2)
-
-            if even_row:
-                fmt = self.EVEN_FORMAT
-            else:
-                fmt = self.ODD_FORMAT
-
-            worksheet.write_row(
-                cur_row,
-                0,
-                [
-                    pos["name"],
-                    pos["country"],
-                    pos["one_price"],
-                    pos["count"],
-                    pos["whole_price"],
-                    pos["avr_price"],
-                    profit,
-                    pos["dividend"],
-                    div_profit,
-                    profit + div_profit,
-                    pos["div_price"],
-                    pos["div_date"],
-                ],
-                fmt,
-            )
-            cur_row += 1
-            even_row = not even_row
-
-        cur_col = 14
-        sector_names = []
-        sector_nums = []
-        for sector in data["sector"]:
-            sector_names.append(sector)
-            sector_nums.append(data["sector"][sector])
-        sector_names = list(map(lambda x: x.strip().capitalize(), sector_names))
-        worksheet.write_row(0, cur_col, sector_names)
-        worksheet.write_row(1, cur_col, sector_nums)
+        self._write_positions(worksheet, data["positions"], SHARE_COLUMNS, 11)
 
         self._make_pie(
             worksheet,
@@ -437,14 +591,27 @@ class View:
         for i in width:
             worksheet.set_column(f"{i}:{i}", width[i])
 
+        cur_col = 8
+        focus_names = [focus.strip().capitalize() for focus in data["focus_type"]]
+        focus_nums = list(data["focus_type"].values())
+
         worksheet.write(0, 0, "Общая информация", self.HEADER_FORMAT)
+        worksheet.write_row(0, cur_col, focus_names)
         worksheet.write_row(1, 0, ["Общая стоимость", data["total_price"]])
+        worksheet.write_row(1, cur_col, focus_nums)
         worksheet.write_row(2, 0, ["Общее количество", data["total_amount"]])
         worksheet.write_row(
             3, 0, ["Доля в портфеле", round(data["total_price"] / whole_price * 100, 2) if whole_price > 0 else 0]
         )
         worksheet.write_row(4, 0, ["Доходность покупок, Р", data["buy_profit"]])
-        worksheet.write_row(5, 0, ["Доходность покупок, %", round(data["buy_profit"] / data["total_price"] * 100, 2)])
+        worksheet.write_row(
+            5,
+            0,
+            [
+                "Доходность покупок, %",
+                round(data["buy_profit"] / data["total_price"] * 100 if data["total_price"] > 0 else 0, 2),
+            ],
+        )
 
         worksheet.write(7, 0, "Информация по позициям", self.HEADER_FORMAT)
         worksheet.write_row(
@@ -462,53 +629,7 @@ class View:
             ],
             self.TABLE_HEADER_FORMAT,
         )
-        cur_row = 9
-        even_row = True
-        for pos in data["positions"]:
-            profit_percent = round(
-                (
-                    (pos["whole_price"] / (pos["avr_price"] * pos["count"] - 1) * 100)
-                    if (pos["avr_price"] * pos["count"]) > 0
-                    else 0
-                ),
-                2,
-            )
-            profit = round(
-                pos["whole_price"] - pos["avr_price"] * pos["count"] if (pos["avr_price"] * pos["count"]) > 0 else 0, 2
-            )
-
-            if even_row:
-                fmt = self.EVEN_FORMAT
-            else:
-                fmt = self.ODD_FORMAT
-
-            worksheet.write_row(
-                cur_row,
-                0,
-                [
-                    pos["name"],
-                    pos["one_price"],
-                    pos["count"],
-                    pos["whole_price"],
-                    pos["avr_price"],
-                    profit_percent,
-                    profit,
-                    pos["focus_type"],
-                ],
-                cell_format=fmt,
-            )
-            cur_row += 1
-            even_row = not even_row
-
-        cur_col = 8
-        focus_names = []
-        focus_nums = []
-        for sector in data["focus_type"]:
-            focus_names.append(sector)
-            focus_nums.append(data["focus_type"][sector])
-        focus_names = list(map(lambda x: x.strip().capitalize(), focus_names))
-        worksheet.write_row(0, cur_col, focus_names)
-        worksheet.write_row(1, cur_col, focus_nums)
+        self._write_positions(worksheet, data["positions"], ETF_COLUMNS, 9)
 
         self._make_pie(
             worksheet,
@@ -532,11 +653,7 @@ class View:
 
         worksheet.write(5, 0, "Информация по позициям", self.HEADER_FORMAT)
         worksheet.write_row(6, 0, ["Название", "Цена за одну", "Кол-во", "Общая стоимость", "Фокус фонда"])
-        cur_row = 7
-
-        for pos in data["positions"]:
-            worksheet.write_row(cur_row, 0, [pos["name"], pos["one_price"], pos["count"], pos["whole_price"]])
-            cur_row += 1
+        self._write_positions(worksheet, data["positions"], OTHER_COLUMNS, 7, striped=False)
 
     def _make_general_worksheet(self, data, worksheet, workbook, whole_price, worksheet_name):
         worksheet.write(0, 0, "Общая информация", self.HEADER_FORMAT)
@@ -563,6 +680,19 @@ class View:
             "Распределение активов",
         )
 
+    def _write_positions(self, worksheet, positions, columns, start_row, striped=True):
+        """Запись таблицы позиций построчно начиная со start_row, возвращает номер следующей строки"""
+        cur_row = start_row
+        even_row = True
+        for row in positions[columns].round(2).itertuples(index=False):
+            if striped:
+                worksheet.write_row(cur_row, 0, row, self.EVEN_FORMAT if even_row else self.ODD_FORMAT)
+            else:
+                worksheet.write_row(cur_row, 0, row)
+            cur_row += 1
+            even_row = not even_row
+        return cur_row
+
     def _make_pie(
         self,
         worksheet,
@@ -585,14 +715,25 @@ class View:
         chart.add_series(
             {
                 "name": pie_name,
-                "categories": f"={worksheet_name}!{categories_left}:{categories_right}",
-                "values": f"={worksheet_name}!{values_left}:{values_right}",
+                "categories": f"='{worksheet_name}'!{categories_left}:{categories_right}",
+                "values": f"='{worksheet_name}'!{values_left}:{values_right}",
                 "data_lables": {"percentage": True, "value": True},
             }
         )
 
         worksheet.insert_chart(insert_place, chart)
 
+    def show_live(self, live, changes=None):
+        """Обновляемый вывод стоимости портфеля в онлайн режиме, экран очищается перед каждым выводом"""
+        print("\033[H\033[J", end="")
+        print("Обновлено", live.updated_at.strftime("%H:%M:%S"))
+        print("Общая стоимость", round(live.whole_price, 2))
+        for key, value in live.allocation.items():
+            print(f"{key} - {round(value, 2)} ({round(value / live.whole_price, 3) if live.whole_price else 0})")
+        if changes:
+            self.show_rebalance_changes(changes)
+        print("Остановка - Ctrl+C")
+
     def show_rebalance_changes(self, changes):
         print("-" * 15)
         print("Результат")
@@ -0,0 +1,96 @@
+import inspect
+import json
+import threading
+import time
+from collections import defaultdict
+
+from api.proxy import ServicesProxy
+
+# Верхние границы корзин гистограммы задержек в миллисекундах
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class RpcMetrics:
+    """
+    Счётчики вызовов API и гистограммы задержек по методам вида "instruments.bond_by"
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(self._empty_stats)
+
+    @staticmethod
+    def _empty_stats():
+        return {"count": 0, "errors": 0, "total": 0.0, "max": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+
+    def record(self, method, seconds, error=False):
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if seconds * 1000 <= bound), -1)
+        with self._lock:
+            stats = self._stats[method]
+            stats["count"] += 1
+            stats["errors"] += error
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["buckets"][bucket] += 1
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self):
+        """
+        Итоги по методам, отсортированные по суммарному времени: метод -> счётчики, время в мс и гистограмма
+        """
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: item[1]["total"], reverse=True)
+            return {
+                method: {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "total_ms": round(stats["total"] * 1000, 3),
+                    "mean_ms": round(stats["total"] * 1000 / stats["count"], 3),
+                    "max_ms": round(stats["max"] * 1000, 3),
+                    "histogram": dict(zip(labels, stats["buckets"])),
+                }
+                for method, stats in items
+            }
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def instrument(self, client):
+        """
+        Обёртка над Services или AsyncServices, которая замеряет каждый вызов методов сервисов
+        """
+        return ServicesProxy(client, self._timed)
+
+    def _timed(self, service, name, method):
+        key = f"{service}.{name}"
+
+        if inspect.iscoroutinefunction(method):
+
+            async def timed_async(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = await method(*args, **kwargs)
+                except Exception:
+                    self.record(key, time.perf_counter() - started, error=True)
+                    raise
+                self.record(key, time.perf_counter() - started)
+                return result
+
+            return timed_async
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                self.record(key, time.perf_counter() - started, error=True)
+                raise
+            self.record(key, time.perf_counter() - started)
+            return result
+
+        return timed
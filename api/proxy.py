@@ -0,0 +1,31 @@
+class ServicesProxy:
+    """
+    Обёртка над Services или AsyncServices: каждый метод сервиса заменяется на wrap_method(сервис, метод, функция).
+    Собственные методы клиента, например create_market_data_stream, отдаются без обёртки
+    """
+
+    def __init__(self, client, wrap_method):
+        self._client = client
+        self._wrap_method = wrap_method
+        self._services = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if callable(attr):
+            return attr
+        if name not in self._services:
+            self._services[name] = _ServiceProxy(attr, name, self._wrap_method)
+        return self._services[name]
+
+
+class _ServiceProxy:
+    def __init__(self, service, name, wrap_method):
+        self._service = service
+        self._name = name
+        self._wrap_method = wrap_method
+
+    def __getattr__(self, attr):
+        method = getattr(self._service, attr)
+        if not callable(method):
+            return method
+        return self._wrap_method(self._name, attr, method)
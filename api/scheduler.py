@@ -0,0 +1,104 @@
+import asyncio
+import inspect
+import random
+import threading
+import time
+
+import grpc
+
+from api.proxy import ServicesProxy
+from logger.logger import get_logger
+
+log = get_logger()
+
+# Коды ошибок, после которых запрос повторяется с задержкой
+RETRY_CODES = (grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.UNAVAILABLE)
+
+
+class TokenBucket:
+    """
+    Ограничение частоты запросов: rate запросов в минуту, не больше capacity подряд
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate / 60
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Занимает один запрос и возвращает, сколько секунд нужно подождать перед его выполнением
+        """
+        with self._lock:
+            current = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (current - self._updated) * self.rate)
+            self._updated = current
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RequestScheduler:
+    """
+    Планировщик вызовов API: лимиты запросов по сервисам и повтор с экспоненциальной задержкой
+    при превышении лимита или недоступности сервиса
+    """
+
+    def __init__(self, limits, attempts=5, base_delay=0.5, max_delay=30.0):
+        self.buckets = {service: TokenBucket(rate) for service, rate in limits.items()}
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def wrap(self, client):
+        """
+        Обёртка над Services или AsyncServices, через которую все вызовы проходят планировщик
+        """
+        return ServicesProxy(client, self._scheduled)
+
+    def _wait_time(self, service):
+        bucket = self.buckets.get(service)
+        return bucket.reserve() if bucket is not None else 0.0
+
+    def _retry_delay(self, error, attempt):
+        """
+        Задержка перед повтором или None, если ошибку повторять не нужно
+        """
+        if getattr(error, "code", None) not in RETRY_CODES or attempt + 1 >= self.attempts:
+            return None
+        reset = getattr(getattr(error, "metadata", None), "ratelimit_reset", None)
+        if reset:
+            return reset + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def _scheduled(self, service, name, method):
+        if inspect.iscoroutinefunction(method):
+
+            async def scheduled_async(*args, **kwargs):
+                for attempt in range(self.attempts):
+                    await asyncio.sleep(self._wait_time(service))
+                    try:
+                        return await method(*args, **kwargs)
+                    except Exception as e:
+                        delay = self._retry_delay(e, attempt)
+                        if delay is None:
+                            raise
+                        log.warning("Повтор %s.%s через %.1f с: %s", service, name, delay, str(e))
+                        await asyncio.sleep(delay)
+
+            return scheduled_async
+
+        def scheduled(*args, **kwargs):
+            for attempt in range(self.attempts):
+                time.sleep(self._wait_time(service))
+                try:
+                    return method(*args, **kwargs)
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    log.warning("Повтор %s.%s через %.1f с: %s", service, name, delay, str(e))
+                    time.sleep(delay)
+
+        return scheduled
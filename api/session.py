@@ -0,0 +1,97 @@
+import threading
+
+import grpc
+from tinkoff.invest import AsyncClient, Client
+from tinkoff.invest.services import Services
+
+from api.metrics import RpcMetrics
+from logger.logger import get_logger
+
+log = get_logger()
+
+# Коды ошибок, после которых имеет смысл открыть канал заново
+RECONNECT_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.UNKNOWN, grpc.StatusCode.INTERNAL)
+
+
+class Session:
+    """
+    Долгоживущее подключение к API: один канал на всю интерактивную сессию, переподключение при обрыве.
+    Все вызовы через client замеряются в metrics и, если задан scheduler, проходят через планировщик запросов
+    """
+
+    def __init__(self, token, client_factory=Client, metrics=None, scheduler=None, async_client_factory=AsyncClient):
+        self.token = token
+        self.metrics = metrics or RpcMetrics()
+        self.scheduler = scheduler
+        self._client_factory = client_factory
+        self._async_client_factory = async_client_factory
+        self._manager = None
+        self._client = None
+        self._lock = threading.RLock()
+
+    @property
+    def client(self) -> Services:
+        with self._lock:
+            if self._client is None:
+                self._manager = self._client_factory(self.token)
+                self._client = self.wrap(self._manager.__enter__())
+                log.info("Подключение к API открыто")
+            return self._client
+
+    def wrap(self, client):
+        """
+        Подключение замеров и планировщика запросов к клиенту API, в том числе асинхронному
+        """
+        client = self.metrics.instrument(client)
+        if self.scheduler is not None:
+            client = self.scheduler.wrap(client)
+        return client
+
+    def reconnect(self) -> Services:
+        self.close()
+        return self.client
+
+    def call(self, func):
+        """
+        Выполнение func(client) на общем канале, при обрыве канал открывается заново и вызов повторяется один раз
+        """
+        try:
+            return func(self.client)
+        except Exception as e:
+            if getattr(e, "code", None) not in RECONNECT_CODES:
+                raise
+            log.warning("Соединение с API потеряно, переподключение: %s", str(e))
+            return func(self.reconnect())
+
+    async def call_async(self, func):
+        """
+        Выполнение await func(client) на асинхронном клиенте. Асинхронный канал привязан к циклу событий,
+        поэтому открывается на время вызова. При обрыве канал открывается заново и вызов повторяется один раз
+        """
+        try:
+            return await self._call_async(func)
+        except Exception as e:
+            if getattr(e, "code", None) not in RECONNECT_CODES:
+                raise
+            log.warning("Соединение с API потеряно, переподключение: %s", str(e))
+            return await self._call_async(func)
+
+    async def _call_async(self, func):
+        async with self._async_client_factory(self.token) as client:
+            return await func(self.wrap(client))
+
+    def close(self):
+        with self._lock:
+            if self._manager is not None:
+                try:
+                    self._manager.__exit__(None, None, None)
+                except Exception as e:
+                    log.error("Error while closing client %s", str(e))
+            self._manager = None
+            self._client = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
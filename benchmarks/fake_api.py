@@ -0,0 +1,412 @@
+import bisect
+import datetime
+import random
+import threading
+import time
+from collections import Counter
+
+from tinkoff.invest import (
+    Account,
+    AccountStatus,
+    Bond,
+    BondResponse,
+    Coupon,
+    CurrenciesResponse,
+    Currency,
+    Dividend,
+    Etf,
+    EtfResponse,
+    GetAccountsResponse,
+    GetBondCouponsResponse,
+    GetCandlesResponse,
+    GetDividendsResponse,
+    GetLastPricesResponse,
+    HistoricCandle,
+    Instrument,
+    InstrumentResponse,
+    LastPrice,
+    MarketDataResponse,
+    MoneyValue,
+    Operation,
+    OperationsResponse,
+    OperationState,
+    OperationType,
+    PortfolioPosition,
+    PortfolioResponse,
+    PositionsResponse,
+    PositionsSecurities,
+    Quotation,
+    Share,
+    ShareResponse,
+)
+
+# Доли видов бумаг в синтетическом портфеле, остаток - валюты
+BOND_SHARE = 0.4
+FLOATER_SHARE = 0.2
+STOCK_SHARE = 0.35
+ETF_SHARE = 0.2
+CURRENCIES = {"usd": 90.0, "eur": 98.0, "cny": 12.5}
+OPERATION_NAMES = {
+    OperationType(1): "Пополнение брокерского счёта",
+    OperationType(15): "Покупка ценных бумаг",
+    OperationType(21): "Выплата дивидендов",
+    OperationType(23): "Выплата купонов",
+}
+
+
+def _quotation(value):
+    units = int(value)
+    return Quotation(units=units, nano=int(round((value - units) * 10**9)))
+
+
+def _money(value, currency="rub"):
+    units = int(value)
+    return MoneyValue(units=units, nano=int(round((value - units) * 10**9)), currency=currency)
+
+
+class FakeApi:
+    """
+    Локальная замена API: синтетический портфель заданного размера, задержка на каждый вызов и счётчик вызовов.
+    Поток рыночных данных отдаёт ticks случайных изменений цен подписанных бумаг.
+    Подключается через Session(token, client_factory=api.client_factory)
+    """
+
+    def __init__(self, positions=100, accounts=1, years=3, latency=0.0, seed=0, ticks=1000):
+        self.latency = latency
+        self.ticks = ticks
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._now = datetime.datetime.now(datetime.timezone.utc)
+        self._opened = self._now - datetime.timedelta(days=365 * years)
+
+        self.accounts = [
+            Account(id=str(i), name=f"Счёт {i}", opened_date=self._opened, status=AccountStatus(2))
+            for i in range(accounts)
+        ]
+        self.currencies = [
+            Currency(figi=f"CUR_{iso}", iso_currency_name=iso, name=iso.upper(), lot=1, currency="rub")
+            for iso in CURRENCIES
+        ]
+        self.prices = {f"CUR_{iso}": _quotation(price) for iso, price in CURRENCIES.items()}
+        self.instruments = {}
+        self.coupons = {}
+        self.dividends = {}
+        self._closes = {}
+        for i in range(positions):
+            self._make_instrument(f"FIGI{i:06d}", i / max(positions, 1))
+
+        self.positions = {}
+        self.portfolios = {}
+        self.operations = {}
+        figis = list(self.instruments)
+        for account in self.accounts:
+            self._make_account(account.id, figis)
+
+    def _make_instrument(self, figi, part):
+        rnd = self._random
+        if part < BOND_SHARE:
+            placement = self._opened - datetime.timedelta(days=rnd.randint(0, 365 * 3))
+            maturity = self._now + datetime.timedelta(days=rnd.randint(30, 365 * 10))
+            per_year = rnd.choice((2, 4, 12))
+            self.instruments[figi] = (
+                "bond",
+                Bond(
+                    figi=figi,
+                    name=f"Облигация {figi}",
+                    sector=rnd.choice(("financial", "energy", "government")),
+                    country_of_risk_name="Российская Федерация",
+                    initial_nominal=_money(1000),
+                    nominal=_money(1000),
+                    maturity_date=maturity,
+                    placement_date=placement,
+                    coupon_quantity_per_year=per_year,
+                    floating_coupon_flag=part < BOND_SHARE * FLOATER_SHARE,
+                    amortization_flag=False,
+                    lot=1,
+                    currency="rub",
+                ),
+            )
+            self.prices[figi] = _quotation(rnd.uniform(90, 105))
+            self.coupons[figi] = self._make_coupons(figi, placement, maturity, per_year)
+        elif part < BOND_SHARE + STOCK_SHARE:
+            self.instruments[figi] = (
+                "share",
+                Share(
+                    figi=figi,
+                    name=f"Акция {figi}",
+                    sector=rnd.choice(("it", "financial", "energy", "consumer")),
+                    country_of_risk_name="Российская Федерация",
+                    lot=rnd.choice((1, 10, 100)),
+                    currency="rub",
+                ),
+            )
+            self.prices[figi] = _quotation(rnd.uniform(10, 5000))
+            record_date = self._now + datetime.timedelta(days=rnd.randint(-30, 300))
+            self.dividends[figi] = [
+                Dividend(
+                    record_date=record_date,
+                    payment_date=record_date + datetime.timedelta(days=14),
+                    dividend_net=_money(rnd.uniform(1, 100)),
+                )
+            ]
+        elif part < BOND_SHARE + STOCK_SHARE + ETF_SHARE:
+            self.instruments[figi] = (
+                "etf",
+                Etf(
+                    figi=figi,
+                    name=f"Фонд {figi}",
+                    focus_type=rnd.choice(("equity", "fixed_income")),
+                    lot=1,
+                    currency="rub",
+                ),
+            )
+            self.prices[figi] = _quotation(rnd.uniform(1, 200))
+        else:
+            self.instruments[figi] = ("currency", Instrument(figi=figi, name=f"Валюта {figi}", lot=1, currency="rub"))
+            self.prices[figi] = _quotation(rnd.uniform(1, 100))
+
+    def _make_coupons(self, figi, placement, maturity, per_year):
+        step = datetime.timedelta(days=365 // per_year)
+        pay = 1000 * self._random.uniform(0.05, 0.15) / per_year
+        events = []
+        date = placement + step
+        number = 1
+        while date <= maturity:
+            # будущие купоны флоатеров и дальние купоны ещё не определены
+            known = date < self._now + datetime.timedelta(days=180)
+            events.append(
+                Coupon(figi=figi, coupon_date=date, coupon_number=number, pay_one_bond=_money(pay if known else 0))
+            )
+            date += step
+            number += 1
+        return events
+
+    def _make_account(self, account_id, figis):
+        rnd = self._random
+        securities = []
+        portfolio = []
+        operations = []
+        for figi in figis:
+            instrument_type, info = self.instruments[figi]
+            balance = rnd.randint(1, 50)
+            uid = f"{account_id}_{figi}"
+            securities.append(
+                PositionsSecurities(
+                    figi=figi, instrument_type=instrument_type, balance=balance, blocked=0, position_uid=uid
+                )
+            )
+            price = self.prices[figi].units + self.prices[figi].nano / 10**9
+            if instrument_type == "bond":  # цена облигации в процентах от номинала 1000
+                price *= 10
+            portfolio.append(
+                PortfolioPosition(
+                    figi=figi,
+                    instrument_type=instrument_type,
+                    quantity=_quotation(balance),
+                    average_position_price=_money(price * rnd.uniform(0.8, 1.2)),
+                )
+            )
+            buy_date = self._opened + datetime.timedelta(days=rnd.randint(0, 90))
+            operations.append(self._operation("", "", f"{uid}_input", OperationType(1), buy_date, price * balance))
+            operations.append(
+                self._operation(
+                    figi, instrument_type, uid, OperationType(15), buy_date, -price * balance, balance, price
+                )
+            )
+            for event in self.coupons.get(figi, []):
+                if buy_date < event.coupon_date < self._now:
+                    value = (event.pay_one_bond.units + event.pay_one_bond.nano / 10**9) * balance
+                    operations.append(
+                        self._operation(figi, instrument_type, uid, OperationType(23), event.coupon_date, value)
+                    )
+            if instrument_type == "share":
+                date = buy_date + datetime.timedelta(days=rnd.randint(30, 365))
+                while date < self._now:
+                    operations.append(
+                        self._operation(figi, instrument_type, uid, OperationType(21), date, rnd.uniform(1, 100))
+                    )
+                    date += datetime.timedelta(days=365)
+        operations.sort(key=lambda op: op.date)
+
+        self.positions[account_id] = PositionsResponse(
+            money=[_money(rnd.uniform(0, 100000))] + [_money(rnd.uniform(0, 1000), iso) for iso in CURRENCIES],
+            blocked=[_money(0)],
+            securities=securities,
+        )
+        self.portfolios[account_id] = PortfolioResponse(account_id=account_id, positions=portfolio)
+        self.operations[account_id] = operations
+
+    def _operation(self, figi, instrument_type, uid, operation_type, date, value, quantity=0, price=0.0):
+        return Operation(
+            id=f"{uid}_{operation_type.value}_{int(date.timestamp())}",
+            figi=figi,
+            instrument_type=instrument_type,
+            position_uid=uid,
+            operation_type=operation_type,
+            date=date,
+            type=OPERATION_NAMES[operation_type],
+            quantity=quantity,
+            price=_money(price),
+            payment=_money(value),
+            currency="rub",
+            state=OperationState(1),
+        )
+
+    def daily_closes(self, figi):
+        """Дни и цены закрытия бумаги с даты открытия счетов, ряд строится один раз"""
+        with self._lock:
+            if figi not in self._closes:
+                price = self.prices[figi]
+                close = price.units + price.nano / 10**9
+                rnd = random.Random(figi)
+                last = self._now.replace(hour=7, minute=0, second=0, microsecond=0)
+                count = (last - self._opened).days + 1
+                closes = [close]
+                for _ in range(count - 1):
+                    closes.append(closes[-1] * rnd.uniform(0.98, 1.02))
+                days = [last - datetime.timedelta(days=i) for i in range(count)]
+                self._closes[figi] = (days[::-1], closes[::-1])
+            return self._closes[figi]
+
+    def _call(self, name, response):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return response
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def client_factory(self, token):
+        return _FakeClient(self)
+
+
+class _FakeClient:
+    def __init__(self, api):
+        self._services = _FakeServices(api)
+
+    def __enter__(self):
+        return self._services
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class _FakeServices:
+    def __init__(self, api):
+        self.users = _FakeUsers(api)
+        self.operations = _FakeOperations(api)
+        self.instruments = _FakeInstruments(api)
+        self.market_data = _FakeMarketData(api)
+        self._api = api
+
+    def create_market_data_stream(self):
+        return _FakeMarketDataStream(self._api)
+
+
+class _FakeUsers:
+    def __init__(self, api):
+        self._api = api
+
+    def get_accounts(self):
+        return self._api._call("get_accounts", GetAccountsResponse(accounts=self._api.accounts))
+
+
+class _FakeOperations:
+    def __init__(self, api):
+        self._api = api
+
+    def get_positions(self, account_id):
+        return self._api._call("get_positions", self._api.positions[account_id])
+
+    def get_portfolio(self, account_id):
+        return self._api._call("get_portfolio", self._api.portfolios[account_id])
+
+    def get_operations(self, account_id, from_, to):
+        operations = [op for op in self._api.operations[account_id] if from_ <= op.date <= to]
+        return self._api._call("get_operations", OperationsResponse(operations=operations))
+
+
+class _FakeInstruments:
+    def __init__(self, api):
+        self._api = api
+
+    def currencies(self, instrument_status=None):
+        return self._api._call("currencies", CurrenciesResponse(instruments=self._api.currencies))
+
+    def bond_by(self, id_type, id):
+        return self._api._call("bond_by", BondResponse(instrument=self._api.instruments[id][1]))
+
+    def share_by(self, id_type, id):
+        return self._api._call("share_by", ShareResponse(instrument=self._api.instruments[id][1]))
+
+    def etf_by(self, id_type, id):
+        return self._api._call("etf_by", EtfResponse(instrument=self._api.instruments[id][1]))
+
+    def get_instrument_by(self, id_type, id):
+        return self._api._call("get_instrument_by", InstrumentResponse(instrument=self._api.instruments[id][1]))
+
+    def get_bond_coupons(self, figi, from_, to):
+        events = [event for event in self._api.coupons.get(figi, []) if from_ <= event.coupon_date <= to]
+        return self._api._call("get_bond_coupons", GetBondCouponsResponse(events=events))
+
+    def get_dividends(self, figi, from_, to):
+        dividends = [div for div in self._api.dividends.get(figi, []) if from_ <= div.record_date <= to]
+        return self._api._call("get_dividends", GetDividendsResponse(dividends=dividends))
+
+
+class _FakeMarketData:
+    def __init__(self, api):
+        self._api = api
+
+    def get_last_prices(self, figi):
+        prices = self._api.prices
+        last_prices = [LastPrice(figi=item, price=prices[item]) for item in figi if item in prices]
+        return self._api._call("get_last_prices", GetLastPricesResponse(last_prices=last_prices))
+
+    def get_candles(self, figi, from_, to, interval):
+        """Дневные свечи: случайное блуждание цены бумаги, которое приходит к её текущей цене"""
+        days, closes = self._api.daily_closes(figi)
+        start, end = bisect.bisect_left(days, from_), bisect.bisect_left(days, to)
+        candles = [
+            HistoricCandle(
+                time=day,
+                open=_quotation(close),
+                high=_quotation(close),
+                low=_quotation(close),
+                close=_quotation(close),
+                volume=1000,
+                is_complete=day < days[-1],
+            )
+            for day, close in zip(days[start:end], closes[start:end])
+        ]
+        return self._api._call("get_candles", GetCandlesResponse(candles=candles))
+
+
+class _FakeMarketDataStream:
+    def __init__(self, api):
+        self._api = api
+        self._figis = []
+        self._stopped = False
+        self.last_price = self
+
+    def subscribe(self, instruments):
+        self._figis.extend(instrument.figi for instrument in instruments)
+
+    def stop(self):
+        self._stopped = True
+
+    def __iter__(self):
+        rnd = random.Random(len(self._figis))
+        for _ in range(self._api.ticks):
+            if self._stopped or not self._figis:
+                return
+            figi = rnd.choice(self._figis)
+            price = self._api.prices[figi]
+            value = (price.units + price.nano / 10**9) * rnd.uniform(0.99, 1.01)
+            if self._api.latency:
+                time.sleep(self._api.latency)
+            yield MarketDataResponse(last_price=LastPrice(figi=figi, price=_quotation(value)))
@@ -0,0 +1,72 @@
+"""
+Замер времени импорта модулей по выводу python -X importtime, каждый модуль импортируется в отдельном процессе.
+
+    python -m benchmarks.imports --modules main,MVC.model,MVC.view --repeat 5 --json imports.json
+
+Для каждого модуля выводится лучшее из repeat полное время импорта и самые тяжёлые вложенные импорты
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = "main,MVC.controller,MVC.model,MVC.view,MVC.export"
+
+
+def import_times(module):
+    """
+    Время импорта module и всех вложенных модулей в одном новом процессе: модуль -> (собственное, полное) в мкс
+    """
+    env = dict(os.environ, TOKEN=os.environ.get("TOKEN", "benchmark"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure(module, repeat, top):
+    runs = [import_times(module) for _ in range(repeat)]
+    best = min(runs, key=lambda times: times[module][1])
+    heaviest = sorted(
+        ((name, cumulative) for name, (_, cumulative) in best.items() if name != module and "." not in name),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:top]
+    return {"total_ms": best[module][1] / 1000, "heaviest_ms": {name: us / 1000 for name, us in heaviest}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк времени импорта")
+    parser.add_argument("--modules", default=DEFAULT_MODULES, help="модули через запятую")
+    parser.add_argument("--repeat", type=int, default=5, help="число запусков, берётся лучший")
+    parser.add_argument("--top", type=int, default=5, help="сколько самых тяжёлых пакетов показать")
+    parser.add_argument("--json", help="файл для сохранения результатов")
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules.split(","):
+        results[module] = measure(module, args.repeat, args.top)
+        heaviest = ", ".join(f"{name} {ms:.0f}" for name, ms in results[module]["heaviest_ms"].items())
+        print(f"{module:<16} {results[module]['total_ms']:>9.1f} ms   {heaviest}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Замер сбора данных, расчёта аналитики и построения отчета на локальной замене API, без токена и сети.
+
+    python -m benchmarks.portfolio --sizes 10,100,1000,10000 --latency 5 --json bench.json
+
+Для каждого размера портфеля выводятся время, число вызовов API и пик памяти (tracemalloc) по этапам:
+init - создание модели, collect - загрузка с пустым кэшем, build - расчёт аналитики,
+collect_warm - повторная загрузка с заполненным кэшем, value_history - восстановление дневной стоимости
+по операциям и свечам с пустым хранилищем свечей, value_history_warm - то же с заполненным хранилищем,
+report - построение excel отчета с историей операций и стоимости (--streaming - в режиме constant_memory).
+Время этапов включает накладные расходы tracemalloc
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_api import FakeApi
+
+STAGES = ("init", "collect", "build", "collect_warm", "value_history", "value_history_warm", "report")
+
+
+def measure(api, func):
+    api.reset_calls()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"seconds": seconds, "rpc": sum(api.calls.values()), "peak_mb": peak / 2**20}
+
+
+def run(positions, accounts, years, latency, streaming, workdir):
+    from api.session import Session
+    from config.config import settings
+    from MVC.model import Model
+    from MVC.view import View
+
+    settings.cache_dir = os.path.join(workdir, f"cache_{positions}")
+    settings.report_streaming = streaming
+    api = FakeApi(positions=positions, accounts=accounts, years=years, latency=latency)
+    stats = {}
+    with Session("benchmark", client_factory=api.client_factory) as session:
+        model, stats["init"] = measure(api, lambda: Model(api.accounts, session))
+        collected, stats["collect"] = measure(api, lambda: session.call(model._collect_portfolio_data))
+        data, stats["build"] = measure(api, lambda: model._build_accounts_data(*collected))
+        _, stats["collect_warm"] = measure(api, lambda: session.call(model._collect_portfolio_data))
+        value_history, stats["value_history"] = measure(
+            api, lambda: model._build_value_history(session.call(model._replay_accounts))
+        )
+        _, stats["value_history_warm"] = measure(
+            api, lambda: model._build_value_history(session.call(model._replay_accounts))
+        )
+        _, stats["report"] = measure(
+            api,
+            lambda: View().make_report(
+                data,
+                session.metrics.summary(),
+                model.get_operations_history(),
+                settings.report_streaming,
+                value_history,
+            ),
+        )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк портфеля на локальной замене API")
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="размеры портфеля через запятую")
+    parser.add_argument("--accounts", type=int, default=1, help="число счетов")
+    parser.add_argument("--years", type=int, default=3, help="глубина истории операций в годах")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка каждого вызова API в миллисекундах")
+    parser.add_argument("--streaming", action="store_true", help="строить отчет в режиме constant_memory")
+    parser.add_argument("--json", help="файл для сохранения результатов")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TOKEN", "benchmark")
+    logging.getLogger("logger.logger").setLevel(logging.WARNING)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for size in map(int, args.sizes.split(",")):
+                results[size] = run(size, args.accounts, args.years, args.latency / 1000, args.streaming, workdir)
+                for stage in STAGES:
+                    stat = results[size][stage]
+                    print(
+                        f"{size:>7} {stage:<18} {stat['seconds']:>9.3f} s {stat['rpc']:>7} rpc {stat['peak_mb']:>9.1f} MB"
+                    )
+        finally:
+            os.chdir(cwd)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,31 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     token: str
+    account_ids: list[str] = []
+    last_prices_chunk: int = 300
+    cache_dir: str = "cache"
+    async_engine: bool = False
+    max_concurrency: int = 16
+    snapshot_max_age: int = 300
+    full_refresh_interval: int = 3600
+    coupons_refresh_ttl: int = 86400
+    dividends_refresh_ttl: int = 86400
+    instruments_ttl: int = 604800
+    calendar_months: int = 12
+    exact_money: bool = False
+    metrics_file: str = ""
+    report_diagnostics: bool = False
+    report_history: bool = True
+    report_streaming: bool = False
+    report_value_history: bool = False
+    report_returns: bool = False
+    export_formats: list[str] = ["parquet"]
+    daemon_address: str = "127.0.0.1:8765"
+    live_refresh: float = 1.0
+    rate_limits: dict[str, int] = {"users": 100, "instruments": 200, "operations": 200, "market_data": 600}
+    retry_attempts: int = 5
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 30.0
 
     class Config:
         env_file = ".env"
@@ -1,9 +1,27 @@
+import argparse
+
 from MVC.controller import Controller
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--daemon",
+        nargs="?",
+        const="",
+        help="запустить сервис на адресе host:port или unix:/path (по умолчанию settings.daemon_address)"
+        " вместо интерактивного меню",
+    )
+    args = parser.parse_args()
+
     controller = Controller()
-    controller.start_work()
+    if args.daemon is not None:
+        from config.config import settings
+        from MVC.daemon import Daemon
+
+        Daemon(controller).serve(args.daemon or settings.daemon_address)
+    else:
+        controller.start_work()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+CANDLE_DTYPE = np.dtype(
+    [
+        ("time", "datetime64[s]"),
+        ("open", "f8"),
+        ("high", "f8"),
+        ("low", "f8"),
+        ("close", "f8"),
+        ("volume", "i8"),
+        ("is_complete", "?"),
+    ]
+)
+
+
+def _timestamp(value):
+    return value.timestamp() if isinstance(value, datetime.datetime) else float(value)
+
+
+def _to_datetime64(value):
+    return np.datetime64(int(_timestamp(value)), "s")
+
+
+class CandleStore:
+    """
+    Локальное хранилище свечей: одна таблица свечей на figi и интервал в файле .npy, отсортированная по времени
+    и читаемая через memmap без копирования. В SQLite хранятся пути к файлам и уже загруженные промежутки времени,
+    по ним определяется, какие промежутки ещё нужно запросить
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "candles.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS series (figi TEXT, interval INTEGER, path TEXT, PRIMARY KEY (figi, interval))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS coverage (figi TEXT, interval INTEGER, start REAL, end REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS coverage_series ON coverage (figi, interval)")
+        self._conn.commit()
+
+    def get(self, figi, interval, from_=None, to=None):
+        """
+        Свечи figi за [from_, to) - срез memmap без копирования, пустой массив, если свечей нет
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path FROM series WHERE figi = ? AND interval = ?", (figi, int(interval))
+            ).fetchone()
+        if row is None:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        candles = np.load(os.path.join(self._directory, row[0]), mmap_mode="r")
+        start = 0 if from_ is None else np.searchsorted(candles["time"], _to_datetime64(from_), side="left")
+        end = len(candles) if to is None else np.searchsorted(candles["time"], _to_datetime64(to), side="left")
+        return candles[start:end]
+
+    def covered(self, figi, interval):
+        """Загруженные промежутки [start, end) в секундах, по возрастанию и без пересечений"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT start, end FROM coverage WHERE figi = ? AND interval = ? ORDER BY start", (figi, int(interval))
+            ).fetchall()
+
+    def missing(self, figi, interval, from_, to, min_gap=0):
+        """
+        Промежутки внутри [from_, to), которых ещё нет в хранилище. Промежутки короче min_gap секунд
+        пропускаются, кроме последнего, заканчивающегося в to: в нём лежит незавершённая свеча
+        """
+        gaps = []
+        current = _timestamp(from_)
+        end = _timestamp(to)
+        for start, stop in self.covered(figi, interval):
+            if stop <= current:
+                continue
+            if start >= end:
+                break
+            if start > current:
+                gaps.append((current, start))
+            current = max(current, stop)
+        if current < end:
+            gaps.append((current, end))
+        return [
+            (
+                datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc),
+                datetime.datetime.fromtimestamp(stop, tz=datetime.timezone.utc),
+            )
+            for start, stop in gaps
+            if stop - start >= min_gap or stop == end
+        ]
+
+    def save(self, figi, interval, candles, ranges):
+        """
+        Добавление свечей (массив CANDLE_DTYPE) и отметка ranges - пар (from_, to) - загруженными.
+        Свеча с уже известным временем заменяется новой. Таблица записывается в новый файл, поэтому уже
+        открытые memmap остаются целыми
+        """
+        interval = int(interval)
+        existing = self.get(figi, interval)
+        merged = np.concatenate([np.asarray(candles, dtype=CANDLE_DTYPE), existing])
+        _, first = np.unique(merged["time"], return_index=True)  # новая свеча идёт раньше сохранённой
+        merged = merged[first]
+
+        path = None
+        if len(merged):
+            path = f"{figi}_{interval}_{time.time_ns()}.npy"
+            np.save(os.path.join(self._directory, path), merged)
+
+        coverage = sorted(
+            [list(item) for item in self.covered(figi, interval)]
+            + [[_timestamp(start), _timestamp(end)] for start, end in ranges]
+        )
+        joined = []
+        for start, end in coverage:
+            if joined and start <= joined[-1][1]:
+                joined[-1][1] = max(joined[-1][1], end)
+            else:
+                joined.append([start, end])
+
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT path FROM series WHERE figi = ? AND interval = ?", (figi, interval)
+            ).fetchone()
+            if path is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO series (figi, interval, path) VALUES (?, ?, ?)", (figi, interval, path)
+                )
+            self._conn.execute("DELETE FROM coverage WHERE figi = ? AND interval = ?", (figi, interval))
+            self._conn.executemany(
+                "INSERT INTO coverage (figi, interval, start, end) VALUES (?, ?, ?, ?)",
+                [(figi, interval, start, end) for start, end in joined],
+            )
+            self._conn.commit()
+        if path is not None and old is not None:
+            self._remove(old[0])
+
+    def invalidate(self, figi=None):
+        with self._lock:
+            if figi is None:
+                paths = self._conn.execute("SELECT path FROM series").fetchall()
+                self._conn.execute("DELETE FROM series")
+                self._conn.execute("DELETE FROM coverage")
+            else:
+                paths = self._conn.execute("SELECT path FROM series WHERE figi = ?", (figi,)).fetchall()
+                self._conn.execute("DELETE FROM series WHERE figi = ?", (figi,))
+                self._conn.execute("DELETE FROM coverage WHERE figi = ?", (figi,))
+            self._conn.commit()
+        for (path,) in paths:
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(os.path.join(self._directory, path))
+        except OSError:  # файл ещё открыт через memmap, например в Windows
+            pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
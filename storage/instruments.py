@@ -0,0 +1,53 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class InstrumentCache:
+    """
+    Локальное хранилище информации об инструментах в SQLite с ключом figi.
+    API отдаёт информацию об инструменте только целиком, поэтому время загрузки хранится одно на запись,
+    а устаревшей её считает вызывающий код по settings.instruments_ttl
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS instruments ("
+            "figi TEXT PRIMARY KEY, instrument_type TEXT, payload BLOB, updated_at REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, figi):
+        """Информация об инструменте и время её загрузки или None, если записи нет"""
+        with self._lock:
+            row = self._conn.execute("SELECT payload, updated_at FROM instruments WHERE figi = ?", (figi,)).fetchone()
+        if row is None:
+            return None
+        payload, updated_at = row
+        return pickle.loads(payload), updated_at
+
+    def set(self, figi, instrument_type, info):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO instruments (figi, instrument_type, payload, updated_at) VALUES (?, ?, ?, ?)",
+                (figi, instrument_type, pickle.dumps(info), time.time()),
+            )
+            self._conn.commit()
+
+    def invalidate(self, figi=None):
+        """Удаление записи по figi, без figi очищается всё хранилище"""
+        with self._lock:
+            if figi is None:
+                self._conn.execute("DELETE FROM instruments")
+            else:
+                self._conn.execute("DELETE FROM instruments WHERE figi = ?", (figi,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,82 @@
+import datetime
+import os
+import pickle
+import sqlite3
+import threading
+
+# Сколько операций читается из базы за один раз при обходе журнала
+ITER_BATCH = 1000
+
+
+class OperationsLedger:
+    """
+    Локальный журнал операций по счетам в SQLite.
+    Хранит уже загруженные операции и момент, до которого счёт синхронизирован.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS operations ("
+            "id TEXT, account_id TEXT, date REAL, payload BLOB, PRIMARY KEY (account_id, id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS operations_date ON operations (account_id, date)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sync_state (account_id TEXT PRIMARY KEY, synced_to REAL)")
+        self._conn.commit()
+
+    def last_synced(self, account_id):
+        with self._lock:
+            row = self._conn.execute("SELECT synced_to FROM sync_state WHERE account_id = ?", (account_id,)).fetchone()
+        if row is None:
+            return None
+        return datetime.datetime.fromtimestamp(row[0], tz=datetime.timezone.utc)
+
+    def save(self, account_id, operations, synced_to):
+        """Сохранение операций (повторно загруженные перезаписываются по id) и отметки синхронизации"""
+        rows = [
+            (
+                op.id or f"{op.date.timestamp()}_{op.figi}_{op.operation_type}",
+                account_id,
+                op.date.timestamp(),
+                pickle.dumps(op),
+            )
+            for op in operations
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO operations (id, account_id, date, payload) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (account_id, synced_to) VALUES (?, ?)",
+                (account_id, synced_to.timestamp()),
+            )
+            self._conn.commit()
+
+    def iter_operations(self, account_id):
+        """Генератор операций счёта в порядке дат, в памяти держится не больше ITER_BATCH операций"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT payload FROM operations WHERE account_id = ? ORDER BY date", (account_id,)
+            )
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(ITER_BATCH)
+            if not rows:
+                break
+            for (payload,) in rows:
+                yield pickle.loads(payload)
+
+    def get_operations(self, account_id):
+        return list(self.iter_operations(account_id))
+
+    def invalidate(self, account_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM operations WHERE account_id = ?", (account_id,))
+            self._conn.execute("DELETE FROM sync_state WHERE account_id = ?", (account_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
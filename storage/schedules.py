@@ -0,0 +1,48 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+
+class ScheduleCache:
+    """
+    Локальное хранилище графиков выплат (купонов, дивидендов) в SQLite с ключом figi, одна таблица на вид выплат
+    """
+
+    def __init__(self, path, table):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (figi TEXT PRIMARY KEY, payload BLOB, updated_at REAL)")
+        self._conn.commit()
+
+    def get(self, figi):
+        """Сохранённый график и время его загрузки или None"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT payload, updated_at FROM {self._table} WHERE figi = ?", (figi,)
+            ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def set(self, figi, events, updated_at):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self._table} (figi, payload, updated_at) VALUES (?, ?, ?)",
+                (figi, pickle.dumps(events), updated_at),
+            )
+            self._conn.commit()
+
+    def invalidate(self, figi=None):
+        with self._lock:
+            if figi is None:
+                self._conn.execute(f"DELETE FROM {self._table}")
+            else:
+                self._conn.execute(f"DELETE FROM {self._table} WHERE figi = ?", (figi,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
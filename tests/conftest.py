@@ -0,0 +1,4 @@
+import os
+
+# настройки читаются при импорте config.config, токен для тестов не нужен
+os.environ.setdefault("TOKEN", "test")
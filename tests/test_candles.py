@@ -0,0 +1,37 @@
+import datetime
+
+import numpy as np
+
+from storage.candles import CANDLE_DTYPE, CandleStore
+
+DAY = 86400
+
+
+def _candle(time, is_complete):
+    candle = np.zeros(1, dtype=CANDLE_DTYPE)
+    candle["time"] = np.datetime64(int(time.timestamp()), "s")
+    candle["close"] = 100
+    candle["is_complete"] = is_complete
+    return candle
+
+
+def test_missing_keeps_incomplete_candle_on_same_day(tmp_path):
+    store = CandleStore(str(tmp_path))
+    today = datetime.datetime(2025, 3, 10, tzinfo=datetime.timezone.utc)
+    start = today - datetime.timedelta(days=30)
+    first_sync = today + datetime.timedelta(hours=10)
+    # первая синхронизация: незавершённая сегодняшняя свеча, загружено только до её начала
+    store.save("FIGI", 5, _candle(today, False), [(start, today)])
+
+    second_sync = first_sync + datetime.timedelta(hours=3)
+    assert store.missing("FIGI", 5, start, second_sync, DAY) == [(today, second_sync)]
+
+
+def test_missing_skips_short_inner_gaps(tmp_path):
+    store = CandleStore(str(tmp_path))
+    start = datetime.datetime(2025, 3, 1, tzinfo=datetime.timezone.utc)
+    end = start + datetime.timedelta(days=10)
+    gap = start + datetime.timedelta(days=5)
+    store.save("FIGI", 5, np.empty(0, dtype=CANDLE_DTYPE), [(start, gap), (gap + datetime.timedelta(hours=1), end)])
+
+    assert store.missing("FIGI", 5, start, end, DAY) == []
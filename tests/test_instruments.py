@@ -0,0 +1,28 @@
+import time
+
+from storage.instruments import InstrumentCache
+
+
+def test_get_returns_info_with_load_time(tmp_path):
+    cache = InstrumentCache(str(tmp_path / "instruments.sqlite3"))
+    before = time.time()
+    cache.set("FIGI", "share", {"name": "Акция", "lot": 10})
+
+    info, updated_at = cache.get("FIGI")
+
+    assert info == {"name": "Акция", "lot": 10}
+    assert before <= updated_at <= time.time()
+    assert cache.get("OTHER") is None
+
+
+def test_invalidate(tmp_path):
+    cache = InstrumentCache(str(tmp_path / "instruments.sqlite3"))
+    for figi in ("A", "B", "C"):
+        cache.set(figi, "share", figi)
+
+    cache.invalidate("A")
+    assert cache.get("A") is None
+    assert cache.get("B") is not None
+
+    cache.invalidate()
+    assert cache.get("B") is None and cache.get("C") is None
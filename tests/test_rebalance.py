@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from MVC.rebalance import lot_quantities, no_sell_total, rebalance_by_lots
+
+
+def test_no_sell_total_fits_every_group():
+    old = {"share": 600, "bond": 300, "etf": 100}
+    new = {"share": 0.5, "bond": 0.4, "etf": 0.1}
+
+    total = no_sell_total(old, new, 1000)
+
+    assert total == 1200
+    assert all(total * new[group] >= value for group, value in old.items())
+
+
+def test_no_sell_total_keeps_whole_money_when_nothing_to_add():
+    assert no_sell_total({"share": 500, "bond": 500}, {"share": 0.5, "bond": 0.5}, 1000) == 1000
+
+
+def test_lot_quantities_never_buys_past_target():
+    prices = np.array([1000.0, 3.0])
+    lots = np.array([1.0, 1.0])
+    targets = np.array([1500.0, 10.0])
+
+    counts, remaining = lot_quantities(prices, lots, np.zeros(2), targets)
+
+    np.testing.assert_array_equal(counts, [1, 3])
+    assert remaining == 501
+
+
+def test_lot_quantities_random_targets():
+    rng = np.random.default_rng(0)
+    prices = rng.uniform(1, 500, 50)
+    lots = rng.choice([1.0, 10.0, 100.0], 50)
+    counts = rng.integers(0, 20, 50) * lots
+    targets = rng.uniform(0, 50000, 50)
+
+    new_counts, _ = lot_quantities(prices, lots, counts, targets)
+
+    assert np.all(new_counts >= 0)
+    assert np.all((new_counts - counts) % lots == 0)
+    assert np.all(new_counts * prices <= targets + 1e-9)
+    assert np.all(targets - new_counts * prices < prices * lots)
+
+
+def test_lot_quantities_without_sell_keeps_positions():
+    prices = np.array([10.0, 20.0])
+    lots = np.array([1.0, 1.0])
+    counts = np.array([50.0, 0.0])
+
+    new_counts, _ = lot_quantities(prices, lots, counts, np.array([100.0, 400.0]), allow_sell=False)
+
+    np.testing.assert_array_equal(new_counts, [50, 20])
+
+
+def test_rebalance_by_lots_sells_only_held_lots():
+    frame = pd.DataFrame(
+        {
+            "figi": ["A", "B"],
+            "name": ["A", "B"],
+            "group": ["share", "bond"],
+            "count": [72.0, 0.0],
+            "price": [10.0, 100.0],
+        }
+    ).assign(lot=[100.0, 1.0])
+
+    res, cash = rebalance_by_lots(frame, {"share": 720, "bond": 0}, {"share": 0.1, "bond": 0.9}, 1000)
+
+    assert res["new_count"].tolist() == [72, 0]
+    assert cash == 1000 - 720
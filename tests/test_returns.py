@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from MVC.returns import time_weighted, xirr
+
+
+def test_xirr_two_flows():
+    rates = xirr(np.array([-1000.0, 1100.0]), np.array([0.0, 1.0]), np.array([0, 0]), 1)
+
+    assert rates[0] == pytest.approx(0.1)
+
+
+def test_xirr_half_year():
+    # 1000 -> 1050 за полгода: (1.05) ** 2 - 1
+    rates = xirr(np.array([-1000.0, 1050.0]), np.array([0.0, 0.5]), np.array([0, 0]), 1)
+
+    assert rates[0] == pytest.approx(0.1025)
+
+
+def test_xirr_without_sign_change():
+    amounts = np.array([-1000.0, 1100.0, 500.0, 700.0])
+    years = np.array([0.0, 1.0, 0.0, 1.0])
+
+    rates = xirr(amounts, years, np.array([0, 0, 1, 1]), 3)
+
+    assert rates[0] == pytest.approx(0.1)
+    assert np.isnan(rates[1])
+    assert np.isnan(rates[2])  # группа без потоков
+
+
+def test_time_weighted_ignores_deposit():
+    # открытие на 1000, +10%, +10% и пополнение на 1000 в конце дня, день без изменений
+    values = np.array([[1000.0], [1100.0], [2210.0], [2210.0]])
+    inflows = np.array([[1000.0], [0.0], [1000.0], [0.0]])
+    zeros = np.zeros_like(values)
+
+    assert time_weighted(values, inflows, zeros, zeros)[0] == pytest.approx(0.21)
+
+
+def test_time_weighted_counts_withdrawal_and_income():
+    values = np.array([[1000.0], [600.0]])
+    inflows = np.array([[1000.0], [0.0]])
+    outflows = np.array([[0.0], [500.0]])
+    income = np.array([[0.0], [50.0]])
+
+    # 600 + 500 выведено + 50 выплат от 1000
+    assert time_weighted(values, inflows, outflows, income)[0] == pytest.approx(0.15)
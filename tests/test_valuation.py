@@ -0,0 +1,112 @@
+import copy
+import random
+
+import pandas as pd
+import pytest
+
+from MVC.valuation import PortfolioValuation, compute_price_columns
+
+
+def _positions(prices):
+    frame = pd.DataFrame(
+        {
+            "figi": ["A", "B", "C"],
+            "instrument_type": "share",
+            "sector": ["it", "it", "energy"],
+            "last_price": prices,
+            "nominal": 0.0,
+            "count": [10.0, 5.0, 2.0],
+            "avr_price": [90.0, 210.0, 40.0],
+            "coupons": 0.0,
+            "dividend": [5.0, 0.0, 1.0],
+            "coupons_future_profit": 0.0,
+        }
+    )
+    return compute_price_columns(frame)
+
+
+def _account(prices):
+    """Данные счёта с одними акциями, итоги считаются заново по всей таблице"""
+    positions = _positions(prices)
+    return {
+        "share": {
+            "total_price": float(positions["whole_price"].sum()),
+            "total_amount": float(positions["count"].sum()),
+            "buy_profit": float(positions["buy_profit"].sum()),
+            "positions": positions,
+            "dividend": 0,
+            "sector": positions.groupby("sector")["whole_price"].sum().to_dict(),
+        },
+        "whole_price": 1000 + float(positions["whole_price"].sum()),
+    }
+
+
+def _assert_same(actual, expected, path=""):
+    if isinstance(expected, dict):
+        assert set(actual) == set(expected), path
+        for key in expected:
+            _assert_same(actual[key], expected[key], f"{path}/{key}")
+    elif isinstance(expected, pd.DataFrame):
+        if "figi" in expected:
+            actual = actual.sort_values("figi", ignore_index=True)
+            expected = expected.sort_values("figi", ignore_index=True)
+        pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-9)
+    else:
+        assert actual == pytest.approx(expected), path
+
+
+def test_reprice_matches_full_rebuild():
+    data = {"1": _account([100.0, 200.0, 50.0])}
+    before = copy.deepcopy(data)
+    valuation = PortfolioValuation(data, {}, {}, {})
+
+    assert valuation.reprice({"A": 110.0, "B": 200.0, "C": 45.0, "UNKNOWN": 1.0}) == 2
+
+    _assert_same(valuation.data, {"1": _account([110.0, 200.0, 45.0])})
+    _assert_same(data, before)
+
+
+def test_reprice_without_changes_keeps_data():
+    data = {"1": _account([100.0, 200.0, 50.0])}
+    valuation = PortfolioValuation(data, {}, {}, {})
+
+    assert valuation.reprice({"A": 100.0}) == 0
+    assert valuation.data is data
+
+
+@pytest.mark.parametrize("rate_change", [1.0, 1.05])
+def test_reprice_matches_full_reload(tmp_path, monkeypatch, rate_change):
+    pytest.importorskip("tinkoff.invest")
+    from api.session import Session
+    from benchmarks.fake_api import FakeApi, _quotation
+    from config.config import settings
+    from MVC.model import Model
+
+    monkeypatch.setattr(settings, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "snapshot_max_age", -1)
+    api = FakeApi(positions=60, accounts=2, years=1)
+    with Session("test", client_factory=api.client_factory) as session:
+        model = Model(api.accounts, session)
+        snapshot = model.get_snapshot()
+        before = copy.deepcopy(snapshot.data)
+
+        rnd = random.Random(0)
+        for figi in rnd.sample([figi for figi in api.prices if not figi.startswith("CUR_")], 20):
+            price = api.prices[figi]
+            api.prices[figi] = _quotation((price.units + price.nano / 10**9) * rnd.uniform(0.9, 1.1))
+        for figi in [figi for figi in api.prices if figi.startswith("CUR_")]:
+            price = api.prices[figi]
+            api.prices[figi] = _quotation((price.units + price.nano / 10**9) * rate_change)
+
+        repriced = copy.deepcopy(model.get_snapshot().data)
+        reloaded = model.get_snapshot(refresh=True).data
+
+    _assert_same(snapshot.data, before)
+    for data in (repriced, reloaded):
+        for account_data in data.values():
+            for _, asset in account_data.items():
+                if isinstance(asset, dict):
+                    for key, value in asset.items():
+                        if isinstance(value, pd.DataFrame):
+                            asset[key] = value.drop(columns=["days_before_maturity"])
+    _assert_same(repriced, reloaded)
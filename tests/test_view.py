@@ -0,0 +1,53 @@
+import pandas as pd
+
+from MVC.view import ETF_COLUMNS, FLOATER_BOND_COLUMNS, REGULAR_BOND_COLUMNS, SHARE_COLUMNS, View
+
+
+def _empty_positions():
+    columns = dict.fromkeys(REGULAR_BOND_COLUMNS + FLOATER_BOND_COLUMNS + SHARE_COLUMNS + ETF_COLUMNS)
+    frame = pd.DataFrame(columns=list(columns), dtype=float)
+    for column in ("placement_date", "maturity_date", "div_date"):
+        frame[column] = pd.to_datetime(frame[column], utc=True)
+    return frame
+
+
+def _empty_account():
+    """Счёт только с деньгами: ни облигаций, ни акций, ни фондов"""
+    return {
+        "bond": {
+            "total_price": 0.0,
+            "regular_price": 0.0,
+            "floater_price": 0.0,
+            "total_amount": 0.0,
+            "regular_amount": 0.0,
+            "floater_amount": 0.0,
+            "floater_coupon": 0,
+            "regular_coupon": 0,
+            "regular_positions": _empty_positions(),
+            "floater_positions": _empty_positions(),
+            "sector": {},
+        },
+        "share": {
+            "total_price": 0.0,
+            "total_amount": 0.0,
+            "buy_profit": 0.0,
+            "positions": _empty_positions(),
+            "dividend": 0,
+            "sector": {},
+        },
+        "etf": {
+            "total_price": 0.0,
+            "total_amount": 0.0,
+            "buy_profit": 0.0,
+            "positions": _empty_positions(),
+            "focus_type": {},
+        },
+        "whole_price": 1000.0,
+    }
+
+
+def test_report_with_empty_account(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    assert View().make_report({"1": _empty_account()}) == "ready"
+    assert len(list((tmp_path / "results").glob("report_*.xlsx"))) == 1
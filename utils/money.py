@@ -0,0 +1,69 @@
+from decimal import Decimal
+
+import numpy as np
+
+NANO = 10**9
+
+
+def to_arrays(values):
+    """
+    Разбор списка Quotation/MoneyValue за один проход: массивы units, nano и кодов валют.
+    У Quotation валюты нет, для неё используется рубль
+    """
+    count = len(values)
+    units = np.fromiter((value.units for value in values), dtype=np.int64, count=count)
+    nano = np.fromiter((value.nano for value in values), dtype=np.int64, count=count)
+    currencies = np.array([getattr(value, "currency", "") or "rub" for value in values], dtype=object)
+    return units, nano, currencies
+
+
+def fx_multipliers(currencies, rates):
+    """
+    Курс к рублю для каждого элемента: курс ищется один раз на каждую валюту, а не на каждое значение
+    """
+    if len(currencies) == 0:
+        return np.ones(0)
+    codes, inverse = np.unique(currencies, return_inverse=True)
+    table = np.array([1.0 if code == "rub" else float(rates.get(code) or 1) for code in codes])
+    return table[inverse]
+
+
+def to_float_array(values, rates=None):
+    """
+    Список Quotation/MoneyValue в массив float, при переданных rates суммы переводятся в рубли
+    """
+    units, nano, currencies = to_arrays(values)
+    amounts = units + nano / NANO
+    if rates is not None:
+        amounts *= fx_multipliers(currencies, rates)
+    return amounts
+
+
+def to_float(value):
+    """Значение одного Quotation/MoneyValue без перевода в рубли"""
+    return value.units + value.nano / NANO
+
+
+def to_decimal(value):
+    """Точное значение Quotation/MoneyValue без ошибок округления float"""
+    return Decimal(value.units) + Decimal(value.nano) / NANO
+
+
+def to_decimal_array(values, rates=None):
+    """
+    Точный режим для сверки: массив Decimal, при переданных rates суммы переводятся в рубли
+    """
+    amounts = np.array([to_decimal(value) for value in values], dtype=object)
+    if rates is not None and len(values):
+        _, _, currencies = to_arrays(values)
+        amounts *= np.array(
+            [Decimal(str(multiplier)) for multiplier in fx_multipliers(currencies, rates)], dtype=object
+        )
+    return amounts
+
+
+def convert(values, rates=None, exact=False):
+    """Перевод списка Quotation/MoneyValue в массив float или, в точном режиме, Decimal"""
+    if exact:
+        return to_decimal_array(values, rates)
+    return to_float_array(values, rates)